@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from itertools import combinations
+from typing import Iterator
+
+from pydantic import BaseModel
+
+from models import Course, Solution
+from parallel_planner import _init_worker, _worker_task
+from pruning_grid import PruningGrid
+from search_problem import Placement, SearchProblem
+from search_stats import SearchStats
+from solution_heap import ComboHeaps, combo_limit
+
+
+class PlanRequest(BaseModel):
+    id: str
+    courses: list[str]
+    target_num: int
+    assigned_indexes: dict[str, str] = {}
+
+
+@dataclass
+class PlanResult:
+    request: PlanRequest
+    solutions: list[Solution] = field(default_factory=list)
+    stats: SearchStats = field(default_factory=SearchStats)
+    seconds: float = 0
+    # Requested courses with no page in the catalog, planned without
+    missing: list[str] = field(default_factory=list)
+    error: str | None = None
+
+    def to_json(self) -> str:
+        data: dict = {"id": self.request.id}
+        if self.missing:
+            data["missing"] = self.missing
+        if self.error is not None:
+            data["error"] = self.error
+        else:
+            data["solutions"] = [
+                solution.model_dump(mode="json") for solution in self.solutions
+            ]
+            data["nodes"] = self.stats.nodes
+        data["seconds"] = round(self.seconds, 4)
+        return json.dumps(data)
+
+
+@dataclass
+class BatchJob:
+    """A request being solved: its heap and the tasks it still has in flight."""
+
+    result: PlanResult
+    vacant: tuple[Placement, ...]
+    # The shared problem with `vacant` applied, to build solutions from
+    problem: SearchProblem
+    start: float
+    # Each combination's top entries and, in combo_heaps.heap, the request's
+    combo_heaps: ComboHeaps
+    open_tasks: int = 0
+
+
+@dataclass
+class BatchPlanner:
+    """
+    Solves many PlanRequests over one catalog. The conflict table and
+    SearchProblem are built once and every request shares one process pool.
+    """
+
+    all_courses: dict[str, Course]
+    conflict_cache: str | None = None
+    node_budget: int = 20_000
+    max_workers: int | None = None
+    # Reuse search results for subtrees repeated across combinations
+    memoize: bool = False
+    # Score leaves in NumPy batches rather than one at a time
+    batch_leaves: bool = False
+    pruning_grid: PruningGrid = field(init=False)
+    problem: SearchProblem = field(init=False)
+
+    def __post_init__(self):
+        self.pruning_grid = PruningGrid.load_or_construct(
+            self.all_courses, self.conflict_cache
+        )
+        self.problem = SearchProblem.compile(self.pruning_grid, defaultdict(set))
+        if self.batch_leaves:
+            self.problem = self.problem.with_leaf_features()
+
+    def vacant_placements(self, request: PlanRequest) -> tuple[Placement, ...]:
+        """Assigned indexes: already held, so they need no vacancy."""
+        placements = []
+        for code, idx in request.assigned_indexes.items():
+            pos = self.problem.codes.index(code)
+            key = self.all_courses[code].get_index(idx).index
+            placements.append((pos, self.problem.index_keys[pos].index(key)))
+        return tuple(sorted(placements))
+
+    def run(self, requests: list[PlanRequest]) -> Iterator[PlanResult]:
+        """Yields each request's result as soon as all its tasks finish."""
+        workers = self.max_workers or os.cpu_count() or 1
+        # Tasks are handed to the pool a few at a time, so each one starts
+        # with its request's latest threshold as the floor to prune against
+        queued: deque[tuple[BatchJob, tuple[int, ...], tuple[Placement, ...]]]
+        queued = deque()
+        for request in requests:
+            result = PlanResult(request)
+            result.missing = sorted(set(request.courses) - set(self.all_courses))
+            courses = set(request.courses) - set(result.missing)
+            try:
+                all_combos = list(
+                    combinations(
+                        sorted(self.problem.positions(courses)), request.target_num
+                    )
+                )
+                if not all_combos:
+                    raise ValueError(
+                        f"Cannot take {request.target_num} of {len(courses)} courses"
+                    )
+                vacant = self.vacant_placements(request)
+            except (KeyError, ValueError) as exc:
+                result.error = str(exc)
+                yield result
+                continue
+            job = BatchJob(
+                result,
+                vacant,
+                self.problem.with_vacant(vacant) if vacant else self.problem,
+                time.perf_counter(),
+                ComboHeaps(combo_limit(len(all_combos))),
+            )
+            for combo in all_combos:
+                queued.append((job, combo, ()))
+            job.open_tasks += len(all_combos)
+
+        shm = self.problem.to_shared_memory()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_worker,
+                initargs=(shm.name, None),
+            ) as executor:
+                pending: dict[Future, tuple[BatchJob, tuple[int, ...]]] = {}
+                while queued or pending:
+                    while queued and len(pending) < 2 * workers:
+                        job, combo, prefix = queued.popleft()
+                        future = executor.submit(
+                            _worker_task,
+                            combo,
+                            prefix,
+                            job.combo_heaps.limit,
+                            self.node_budget,
+                            job.combo_heaps.heap.threshold(),
+                            job.vacant,
+                            self.memoize,
+                        )
+                        pending[future] = (job, combo)
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job, combo = pending.pop(future)
+                        job.open_tasks -= 1
+                        try:
+                            entries, stats, deferred, _, _ = future.result()
+                        except Exception as exc:
+                            job.result.error = (
+                                f"Combination generated an exception: {exc}"
+                            )
+                        else:
+                            job.combo_heaps.add_entries(combo, entries)
+                            job.result.stats.merge(stats)
+                            # Ahead of other requests, to finish this one sooner
+                            queued.extendleft((job, combo, sub) for sub in deferred)
+                            job.open_tasks += len(deferred)
+                        if not job.open_tasks:
+                            job.result.solutions = job.problem.materialize(
+                                job.combo_heaps.heap.get_sorted_results()
+                            )
+                            job.result.seconds = time.perf_counter() - job.start
+                            yield job.result
+        finally:
+            shm.close()
+            shm.unlink()
+
+
+def read_requests(path: str) -> list[PlanRequest]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [PlanRequest.model_validate_json(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    from extract import Parser
+
+    arg_parser = argparse.ArgumentParser(
+        description="Plan timetables for a JSONL file of requests."
+    )
+    arg_parser.add_argument("requests", help="JSONL file of PlanRequests")
+    arg_parser.add_argument("results", help="JSONL file to write results to")
+    arg_parser.add_argument("--mods", default="mods", help="folder of course pages")
+    arg_parser.add_argument("--max-workers", type=int, default=None)
+    arg_parser.add_argument(
+        "--memoize", action="store_true", help="reuse repeated subtree searches"
+    )
+    arg_parser.add_argument(
+        "--batch-leaves", action="store_true", help="score leaves in NumPy batches"
+    )
+    args = arg_parser.parse_args()
+
+    requests = read_requests(args.requests)
+    start = time.perf_counter()
+    parser = Parser(args.mods, cache_path=os.path.join(args.mods, "parsed.json"))
+    parser.process_all_courses(
+        sorted({code for request in requests for code in request.courses})
+    )
+    planner = BatchPlanner(
+        parser.courses,
+        conflict_cache=os.path.join(args.mods, "conflicts.json"),
+        max_workers=args.max_workers,
+        memoize=args.memoize,
+        batch_leaves=args.batch_leaves,
+    )
+    setup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    failed = 0
+    with open(args.results, "w", encoding="utf-8") as f:
+        for result in planner.run(requests):
+            failed += result.error is not None
+            f.write(result.to_json() + "\n")
+    wall = time.perf_counter() - start
+    print(
+        f"Solved {len(requests) - failed}/{len(requests)} requests in {wall:.2f}s "
+        f"({len(requests) / wall:.1f} requests/sec) after {setup:.2f}s of setup"
+    )
@@ -0,0 +1,398 @@
+"""
+Benchmarks for the planner pipeline on synthetic catalogs.
+
+Each run times Parser loading, PruningGrid.construct, Planner.run_planner
+at several target_num values and SolutionHeap throughput, then appends one
+JSON line to a results file with the commit it ran on, so runs can be
+compared across commits.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from itertools import product
+
+from models import DAYS, Course, Index, Lesson
+from parallel_planner import Planner, PlannerProgress
+from pruning_grid import PruningGrid
+from solution_heap import SolutionHeap
+
+DAY_NAMES = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat")
+INDEX_TYPES = ("Tut", "Lab", "Sem")
+
+
+@dataclass(frozen=True)
+class CatalogSpec:
+    num_courses: int = 12
+    indexes_per_course: int = 20
+    lessons_per_index: int = 3  # the first is a lecture shared by every index
+    # 0 spreads lessons over the whole week, 1 packs them into a single slot
+    clash_density: float = 0.5
+    seed: int = 0
+
+    @property
+    def label(self) -> str:
+        return (
+            f"{self.num_courses}c x {self.indexes_per_course}i x "
+            f"{self.lessons_per_index}l @ {self.clash_density}"
+        )
+
+
+def synthetic_courses(spec: CatalogSpec) -> dict[str, Course]:
+    rng = random.Random(spec.seed)
+    starts = [(day, start) for day in range(1, DAYS + 1) for start in range(8, 18)]
+    rng.shuffle(starts)
+    pool = starts[: max(1, round(len(starts) * (1 - spec.clash_density)))]
+
+    def lesson(lesson_type: str) -> Lesson:
+        day, start = rng.choice(pool)
+        return Lesson(
+            lesson_type=lesson_type,
+            day=day,
+            start=start,
+            duration=rng.choice((1, 2)) if start < 17 else 1,
+        )
+
+    courses = {}
+    for n in range(spec.num_courses):
+        code = f"BM{n:04d}"
+        lecture = lesson("Lec/Studio")
+        indexes = {}
+        for i in range(spec.indexes_per_course):
+            idx = f"{n % 100:02d}{i:03d}"
+            lessons = [lecture] + [
+                lesson(rng.choice(INDEX_TYPES))
+                for _ in range(spec.lessons_per_index - 1)
+            ]
+            indexes[idx] = Index(
+                index=idx, vacancies=rng.choice((0, 0, 1, 5, 20)), lessons=lessons
+            )
+        courses[code] = Course(
+            name=f"BENCHMARK COURSE {n}",
+            code=code,
+            aus=rng.choice((2, 3, 4)),
+            indexes=indexes,
+        )
+    for course in courses.values():
+        course.merge_overlapping_indexes()
+    return courses
+
+
+def course_page(course: Course) -> str:
+    """A course page with just the tables Parser reads, merged indexes split."""
+    cell = '<td><font size="2" style="font-family: Arial">{}</font></td>'
+    rows = []
+    for idx, index in course.indexes.items():
+        for number, (i, lesson) in product(idx.split("/"), enumerate(index.lessons)):
+            times = f"{lesson.start:02d}30to{lesson.start + lesson.duration:02d}20"
+            cells = (
+                f"&nbsp;{number}" if i == 0 else "&nbsp;",
+                lesson.lesson_type,
+                "G1",
+                DAY_NAMES[lesson.day - 1],
+                times,
+                "LT1",
+                "&nbsp;",
+            )
+            rows.append("<tr>" + "".join(cell.format(c) for c in cells) + "</tr>")
+    header = ("Index", "Type", "Group", "Day", "Time", "Venue", "Remark")
+    return (
+        f"<html><head><title>Content of Course: {course.code}</title></head><body>"
+        '<table width="800"><tbody><tr>'
+        f"<td><span>[+]</span> {course.code}</td><td>{course.name}</td>"
+        f"<td>  {course.aus} AU</td><td>BENCH</td>"
+        "</tr></tbody></table>"
+        '<table border="1"><tbody><tr>'
+        + "".join(cell.format(f"<b>{h}</b>") for h in header)
+        + "</tr>"
+        + "\n".join(rows)
+        + "</tbody></table></body></html>"
+    )
+
+
+def vacancy_page(courses: dict[str, Course]) -> str:
+    """
+    A stars.html with an index select per course, as Parser reads it. Merged
+    indexes list their first number with all the vacancies, so they add up.
+    """
+    rows = []
+    for code, course in courses.items():
+        options = "".join(
+            f'<option value="{i}">{i} / {index.vacancies if not n else 0} / 0'
+            "&nbsp;</option>"
+            for idx, index in course.indexes.items()
+            for n, i in enumerate(idx.split("/"))
+        )
+        rows.append(
+            f'<tr><td><font size="-1">{code}</font></td><td>'
+            f'<select name="index_nmbr"><option value="null">-Select one-</option>'
+            f"{options}</select></td></tr>"
+        )
+    return (
+        "<html><body><table><tbody>"
+        + "\n".join(rows)
+        + "</tbody></table></body></html>"
+    )
+
+
+def write_pages(courses: dict[str, Course], folder: str):
+    os.makedirs(folder, exist_ok=True)
+    for code, course in courses.items():
+        with open(f"{folder}/{code}.html", "w", encoding="windows-1252") as f:
+            f.write(course_page(course))
+    with open(f"{folder}/stars.html", "w", encoding="windows-1252") as f:
+        f.write(vacancy_page(courses))
+
+
+def measured_clash_density(pruning_grid: PruningGrid) -> float:
+    """Fraction of index pairs from different courses that clash."""
+    sizes = [len(keys) for keys in pruning_grid.index_keys]
+    clashing, pairs = 0, 0
+    for pos, course in enumerate(pruning_grid.conflicts):
+        for masks in course:
+            for other, mask in enumerate(masks):
+                if other > pos:
+                    clashing += mask.bit_count()
+                    pairs += sizes[other]
+    return clashing / pairs if pairs else 0.0
+
+
+def timed(fn, *args, **kwargs) -> tuple[object, float]:
+    with (
+        open(os.devnull, "w") as devnull,
+        contextlib.redirect_stdout(devnull),
+        contextlib.redirect_stderr(devnull),
+    ):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        return result, time.perf_counter() - start
+
+
+def bench_parser(courses: dict[str, Course], extractor: str) -> dict:
+    from extract import Parser
+
+    with tempfile.TemporaryDirectory() as folder:
+        write_pages(courses, folder)
+        parser = Parser(folder, extractor=extractor)  # type: ignore
+        _, seconds = timed(parser.process_all_courses)
+    if parser.courses != courses:
+        raise ValueError("Parsed synthetic pages don't match their courses")
+    return {
+        "bench": f"parser_{extractor}",
+        "seconds": seconds,
+        "courses_per_sec": len(courses) / seconds,
+    }
+
+
+def bench_grid(courses: dict[str, Course]) -> dict:
+    pruning_grid, seconds = timed(PruningGrid.construct, courses)
+    return {
+        "bench": "pruning_grid",
+        "seconds": seconds,
+        "clash_density": round(measured_clash_density(pruning_grid), 4),  # type: ignore
+    }
+
+
+def bench_planner(
+    courses: dict[str, Course],
+    target_num: int,
+    time_limit: float | None,
+    max_workers: int | None,
+) -> dict:
+    planner = Planner(courses, target_num=target_num, max_workers=max_workers)
+
+    def drain():
+        for progress in planner.iter_planner(time_limit):
+            pass
+        return progress
+
+    progress, seconds = timed(drain)
+    assert isinstance(progress, PlannerProgress)
+    return {
+        "bench": f"planner_k{target_num}",
+        "seconds": seconds,
+        "combos": progress.combos_total,
+        "nodes": planner.stats.nodes,
+        "leaves": planner.stats.leaves,
+        "nodes_per_sec": planner.stats.nodes / seconds,
+        "utilisation": planner.report["utilisation"],
+        "stopped": progress.stopped,
+        "best_score": progress.best_score,
+    }
+
+
+def bench_heap(num_entries: int, limit: int = 50, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    entries = [
+        (
+            (
+                -rng.randint(0, 3),
+                rng.randint(1, 7),
+                rng.randint(0, 7),
+                -rng.randint(0, 20),
+                rng.randint(10, 30),
+            ),
+            tuple(rng.sample(range(1000), 7)),
+        )
+        for _ in range(num_entries)
+    ]
+    solution_heap = SolutionHeap(limit=limit)
+    start = time.perf_counter()
+    for entry in entries:
+        if solution_heap.accepts(entry[0]):
+            solution_heap.add_entry(entry)
+    solution_heap.get_sorted_results()
+    seconds = time.perf_counter() - start
+    return {
+        "bench": "solution_heap",
+        "seconds": seconds,
+        "entries_per_sec": num_entries / seconds,
+    }
+
+
+def run_suite(
+    specs: list[CatalogSpec],
+    targets: list[int],
+    time_limit: float | None,
+    max_workers: int | None,
+    heap_entries: int,
+) -> list[dict]:
+    results = []
+    for spec in specs:
+        courses = synthetic_courses(spec)
+        catalog_results = [
+            bench_parser(courses, "soup"),
+            bench_parser(courses, "stream"),
+            bench_grid(courses),
+        ]
+        for target_num in targets:
+            if target_num <= spec.num_courses:
+                catalog_results.append(
+                    bench_planner(courses, target_num, time_limit, max_workers)
+                )
+        for result in catalog_results:
+            result["catalog"] = spec.label
+            print(format_result(result))
+        results += [{"spec": asdict(spec), **result} for result in catalog_results]
+    heap_result = bench_heap(heap_entries)
+    print(format_result(heap_result))
+    results.append(heap_result)
+    return results
+
+
+def format_result(result: dict) -> str:
+    extras = ", ".join(
+        f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}"
+        for key, value in result.items()
+        if key not in ("bench", "seconds", "catalog", "spec")
+    )
+    catalog = result.get("catalog", "")
+    return f"{catalog:28} {result['bench']:14} {result['seconds']:8.3f}s  {extras}"
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "-C", os.path.dirname(os.path.abspath(__file__))]
+            + ["rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result: dict) -> tuple:
+    return result["bench"], json.dumps(result.get("spec"), sort_keys=True)
+
+
+def compare(previous: dict, results: list[dict]):
+    """Prints each benchmark's time against the same one in a previous run."""
+    before = {result_key(result): result for result in previous["results"]}
+    print(f"\nCompared with {previous['commit']} ({previous['timestamp']}):")
+    for result in results:
+        old = before.get(result_key(result))
+        if old is None:
+            continue
+        print(
+            f"{result.get('catalog', ''):28} {result['bench']:14} "
+            f"{old['seconds']:8.3f}s -> {result['seconds']:8.3f}s "
+            f"({old['seconds'] / result['seconds']:.2f}x)"
+        )
+
+
+def record(path: str, run: dict) -> dict | None:
+    """Appends the run to path and returns the previous run of the same suite."""
+    previous = None
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    earlier = json.loads(line)
+                    if earlier["suite"] == run["suite"]:
+                        previous = earlier
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run) + "\n")
+    return previous
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark the planner pipeline on synthetic catalogs."
+    )
+    arg_parser.add_argument(
+        "--courses", type=int, nargs="+", default=[8, 12, 16], help="catalog sizes"
+    )
+    arg_parser.add_argument("--indexes", type=int, default=20)
+    arg_parser.add_argument("--lessons", type=int, default=3)
+    arg_parser.add_argument(
+        "--density", type=float, nargs="+", default=[0.5], help="clash densities"
+    )
+    arg_parser.add_argument(
+        "--targets", type=int, nargs="+", default=[4, 5, 6], help="target_num values"
+    )
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument(
+        "--time-limit", type=float, default=60, help="per planner run, in seconds"
+    )
+    arg_parser.add_argument("--max-workers", type=int, default=None)
+    arg_parser.add_argument("--heap-entries", type=int, default=200_000)
+    arg_parser.add_argument(
+        "--out", default="benchmarks.jsonl", help="JSONL file to append results to"
+    )
+    args = arg_parser.parse_args()
+
+    specs = [
+        CatalogSpec(num_courses, args.indexes, args.lessons, density, args.seed)
+        for num_courses in args.courses
+        for density in args.density
+    ]
+    results = run_suite(
+        specs, args.targets, args.time_limit, args.max_workers, args.heap_entries
+    )
+    run = {
+        "suite": " ".join(
+            f"{key}={value}"
+            for key, value in sorted(vars(args).items())
+            if key not in ("out", "max_workers")
+        ),
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "max_workers": args.max_workers,
+        "results": results,
+    }
+    previous = record(args.out, run)
+    if previous is not None:
+        compare(previous, results)
+    print(f"\nRecorded {len(results)} results to {args.out}")
@@ -1,11 +1,43 @@
+import hashlib
+import json
+import multiprocessing
 import os
 import re
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass, field
+from typing import Iterable, Literal
 
 from bs4 import BeautifulSoup
 
 from models import Course, Index, Lesson
+from stream_extract import course_cell_texts, vacancy_row_texts
+
+# Bump whenever a change to extraction would change its output, so cached
+# results from older versions are thrown away
+PARSER_VERSION = 1
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_vacancies(vacancies: dict[str, dict[str, int]], course: str, index: str) -> int:
+    """Vacancies of an index in a stars.html snapshot, 10 if its course is absent."""
+    vacancy = 10
+    if course in vacancies:
+        vacancy = vacancies[course].get(index, 0)
+    return vacancy
+
+
+def _parse_course_data(folder_path: str, extractor: str, course_code: str) -> dict:
+    """
+    Runs in a worker process. The vacancies in the result are placeholders,
+    the parent fills them in from its own stars.html data.
+    """
+    parser = Parser(folder_path, extractor=extractor)  # type: ignore
+    return parser.parse_course(course_code).model_dump()
 
 
 @dataclass
@@ -15,16 +47,60 @@ class Parser:
         default_factory=lambda: defaultdict(dict)
     )
     courses: dict[str, Course] = field(default_factory=dict)
+    # JSON file of extracted data keyed by file name; None disables caching
+    cache_path: str | None = None
+    # file name -> {"hash": content hash, "data": extracted data}
+    cache: dict[str, dict] = field(default_factory=dict)
+    cache_dirty: bool = False
+    # "soup" builds a BeautifulSoup tree, "stream" only keeps the text it needs
+    extractor: Literal["soup", "stream"] = "soup"
+    # Parse course pages in a process pool rather than one at a time
+    parallel: bool = False
+    max_workers: int | None = None
 
-    def extract_vacancy_data(self):
+    def load_cache(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+        with open(self.cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("version") == PARSER_VERSION:
+            self.cache = cache["files"]
+
+    def save_cache(self):
+        if self.cache_path is None or not self.cache_dirty:
+            return
+        with open(self.cache_path, "w", encoding="utf-8") as f:
+            json.dump({"version": PARSER_VERSION, "files": self.cache}, f)
+        self.cache_dirty = False
+
+    def cached(self, file_name: str) -> tuple[str, dict | None]:
+        """Returns the file's hash and its cached data, if still up to date."""
+        digest = file_hash(f"{self.folder_path}/{file_name}")
+        entry = self.cache.get(file_name)
+        if entry is not None and entry["hash"] == digest:
+            return digest, entry["data"]
+        return digest, None
+
+    def store(self, file_name: str, digest: str, data):
+        if self.cache_path is None:
+            return
+        self.cache[file_name] = {"hash": digest, "data": data}
+        self.cache_dirty = True
+
+    def read(self, file_name: str) -> str:
         with open(
-            f"{self.folder_path}/stars.html",
+            f"{self.folder_path}/{file_name}",
             "r",
             encoding="windows-1252",
             errors="ignore",
         ) as f:
-            soup = BeautifulSoup(f.read(), "html.parser")
+            return f.read()
 
+    @staticmethod
+    def soup_vacancy_row_texts(html: str) -> list[tuple[str, list[str]]]:
+        """(course code text, option texts) for every row with an index select."""
+        soup = BeautifulSoup(html, "html.parser")
+        row_texts = []
         rows = soup.find_all("tr")
         for row in rows:
             select_tag = row.find("select", attrs={"name": "index_nmbr"})
@@ -34,59 +110,104 @@ class Parser:
             if not course_font:
                 continue
             course_code = course_font.get_text(strip=True)  # e.g., 'AB1201'
+            options = select_tag.find_all("option")
+            row_texts.append(
+                (course_code, [option.get_text(strip=True) for option in options])
+            )
+        return row_texts
+
+    def extract_vacancy_data(self):
+        digest, data = self.cached("stars.html")
+        if data is not None:
+            for course_code, vacancies in data.items():
+                self.vacancies[course_code].update(vacancies)
+            return
+
+        html = self.read("stars.html")
+        if self.extractor == "stream":
+            row_texts = vacancy_row_texts(html)
+        else:
+            row_texts = self.soup_vacancy_row_texts(html)
+        for course_code, options in row_texts:
             if len(course_code) != 6:
                 continue
 
-            options = select_tag.find_all("option")
-            for option in options:
-                text = option.get_text(strip=True)
+            for text in options:
                 match = re.search(r"(\d{5})\s*/\s*(\d+)\s*/\s*(\d+)", text)
                 if match:
                     index, vacancy = (match.group(1), int(match.group(2)))
                     self.vacancies[course_code][index] = vacancy
+        self.store("stars.html", digest, self.vacancies)
 
     def get_vacancies(self, course: str, index: str) -> int:
-        vacancy = 10
-        if course in self.vacancies:
-            vacancy = self.vacancies[course].get(index, 0)
-        return vacancy
+        return get_vacancies(self.vacancies, course, index)
+
+    def load_course(self, course_code: str, data: dict):
+        course = Course.model_validate(data)
+        # Vacancies come from stars.html, which changes independently
+        for index in course.indexes.values():
+            index.vacancies = self.get_vacancies(course_code, index.index)
+        self.courses[course_code] = course
 
     def extract_course(self, course_code: str):
-        day_map = {"Mon": 1, "Tue": 2, "Wed": 3, "Thu": 4, "Fri": 5, "Sat": 6, "Sun": 7}
+        digest, data = self.cached(f"{course_code}.html")
+        if data is not None:
+            self.load_course(course_code, data)
+            return
 
-        with open(
-            f"{self.folder_path}/{course_code}.html",
-            "r",
-            encoding="windows-1252",
-            errors="ignore",
-        ) as f:
-            soup = BeautifulSoup(f.read(), "html.parser")
+        self.courses[course_code] = self.parse_course(course_code)
+        self.store(
+            f"{course_code}.html", digest, self.courses[course_code].model_dump()
+        )
+
+    @staticmethod
+    def soup_course_cell_texts(html: str) -> tuple[list[str], list[list[str]]]:
+        """Cell texts of the metadata row, and of each schedule table row."""
+        soup = BeautifulSoup(html, "html.parser")
 
         # 1. Extract Metadata using [+] anchor
         anchor = soup.find(string=re.compile(r"\[\+\]"))
         if not anchor:
-            raise ValueError(f"Could not find metadata anchor [+] for {course_code}")
+            raise ValueError("Could not find metadata anchor [+]")
 
         meta_row = anchor.find_parent("tr")
         meta_cells = meta_row.find_all("td")
 
-        code = meta_cells[0].get_text(strip=True).replace("[+]", "").strip()
-        name = meta_cells[1].get_text(strip=True)
+        # 2. Locate Schedule Table (the next table after the header metadata table)
+        schedule_table = meta_row.find_parent("table").find_next("table")
+        rows = schedule_table.find_all("tr")
+        return (
+            [cell.get_text(strip=True) for cell in meta_cells],
+            [
+                [cell.get_text(strip=True) for cell in row.find_all("td")]
+                for row in rows
+            ],
+        )
+
+    def parse_course(self, course_code: str) -> Course:
+        day_map = {"Mon": 1, "Tue": 2, "Wed": 3, "Thu": 4, "Fri": 5, "Sat": 6, "Sun": 7}
 
-        au_text = meta_cells[2].get_text(strip=True)
+        html = self.read(f"{course_code}.html")
+        try:
+            if self.extractor == "stream":
+                meta_cells, rows = course_cell_texts(html)
+            else:
+                meta_cells, rows = self.soup_course_cell_texts(html)
+        except ValueError as e:
+            raise ValueError(f"{e} for {course_code}")
+
+        code = meta_cells[0].replace("[+]", "").strip()
+        name = meta_cells[1]
+
+        au_text = meta_cells[2]
         au_match = re.search(r"[\d]+", au_text)
         aus = int(au_match.group()) if au_match else 0
 
-        # 2. Locate Schedule Table (the next table after the header metadata table)
-        schedule_table = meta_row.find_parent("table").find_next("table")
-        rows = schedule_table.find_all("tr")[1:]  # Skip "INDEX TYPE..." header row
-
         indexes_data: dict[str, Index] = {}
         current_index = ""
 
-        for row in rows:
-            cells = row.find_all("td")
-            clean_cells = [c.get_text(strip=True).replace("\xa0", "") for c in cells]
+        for row in rows[1:]:  # Skip "INDEX TYPE..." header row
+            clean_cells = [cell.replace("\xa0", "") for cell in row]
 
             if len(clean_cells) < 5 or clean_cells[0] == "INDEX":
                 continue
@@ -122,18 +243,102 @@ class Parser:
                 except (ValueError, IndexError):
                     continue
 
-        self.courses[course_code] = Course(
-            name=name, code=code, aus=aus, indexes=indexes_data
-        )
+        return Course(name=name, code=code, aus=aus, indexes=indexes_data)
+
+    def extract_courses_parallel(self, course_codes: list[str]):
+        """extract_course for each course, parsing cache misses in a process pool."""
+        extracted: dict[str, dict] = {}
+        misses: dict[str, str] = {}
+        for course_code in course_codes:
+            digest, data = self.cached(f"{course_code}.html")
+            if data is None:
+                misses[course_code] = digest
+            else:
+                extracted[course_code] = data
+
+        if misses:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {
+                    executor.submit(
+                        _parse_course_data,
+                        self.folder_path,
+                        self.extractor,
+                        course_code,
+                    ): course_code
+                    for course_code in misses
+                }
+                for future in as_completed(futures):
+                    course_code = futures[future]
+                    try:
+                        extracted[course_code] = future.result()
+                    except Exception as e:
+                        print(f"Failed to extract {course_code}: {e}")
+                        continue
+                    self.store(
+                        f"{course_code}.html",
+                        misses[course_code],
+                        extracted[course_code],
+                    )
+
+        # Keep the serial order so course positions don't depend on timing
+        for course_code in course_codes:
+            if course_code in extracted:
+                self.load_course(course_code, extracted[course_code])
+                print(f"Successfully extracted: {course_code}")
+
+    def extract_as_fetched(self, course_codes: Iterable[str]):
+        """
+        extract_course for each course as soon as `course_codes` yields it,
+        such as pages as their downloads land. With `parallel`, cache misses
+        are parsed in a process pool while later pages are still coming.
+        """
+        if not self.parallel:
+            for course_code in course_codes:
+                try:
+                    self.extract_course(course_code)
+                    print(f"Successfully extracted: {course_code}")
+                except Exception as e:
+                    print(f"Failed to extract {course_code}: {e}")
+            return
+
+        # Pages usually come from other threads, such as CourseFetcher's, and
+        # forking while they run can leave a worker stuck on a lock they held
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+        ) as executor:
+            futures = {}
+            for course_code in course_codes:
+                digest, data = self.cached(f"{course_code}.html")
+                if data is not None:
+                    self.load_course(course_code, data)
+                    print(f"Successfully extracted: {course_code}")
+                    continue
+                future = executor.submit(
+                    _parse_course_data, self.folder_path, self.extractor, course_code
+                )
+                futures[future] = (course_code, digest)
+            for future in as_completed(futures):
+                course_code, digest = futures[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    print(f"Failed to extract {course_code}: {e}")
+                    continue
+                self.store(f"{course_code}.html", digest, data)
+                self.load_course(course_code, data)
+                print(f"Successfully extracted: {course_code}")
 
     def process_all_courses(self, target_courses: list[str] = []):
         if not os.path.exists(self.folder_path):
             print(f"Error: Folder '{self.folder_path}' not found.")
             return {}
+        self.load_cache()
         self.extract_vacancy_data()
         files = [f for f in os.listdir(self.folder_path) if f.endswith(".html")]
         print(f"Found {len(files)} course files. Starting extraction...")
 
+        course_codes = []
         for file_name in files:
             match = re.search(r"([A-Z]{2}\d{4})\.html", file_name)
             if not match:
@@ -142,12 +347,18 @@ class Parser:
             course_code = match.group(1)
             if target_courses and course_code not in target_courses:
                 continue
+            course_codes.append(course_code)
 
-            try:
-                self.extract_course(course_code)
-                print(f"Successfully extracted: {course_code}")
-            except Exception as e:
-                print(f"Failed to extract {course_code}: {e}")
+        if self.parallel:
+            self.extract_courses_parallel(course_codes)
+        else:
+            for course_code in course_codes:
+                try:
+                    self.extract_course(course_code)
+                    print(f"Successfully extracted: {course_code}")
+                except Exception as e:
+                    print(f"Failed to extract {course_code}: {e}")
+        self.save_cache()
         for course in self.courses.values():
             course.merge_overlapping_indexes()
 
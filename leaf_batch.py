@@ -0,0 +1,149 @@
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from models import DAYS, CompiledCatalog
+from pruning_grid import bits
+from solution_heap import STREAKS, Score
+
+if TYPE_CHECKING:
+    from search_problem import Search
+
+ALL_DAYS = (1 << DAYS) - 1
+# Leaves buffered before they are scored together
+LEAF_BATCH = 1024
+# Bits per score component once packed into one int64, offset so that
+# negative components still sort correctly
+FIELD_BITS = 12
+FIELD_OFFSET = 1 << (FIELD_BITS - 1)
+
+POPCOUNTS = np.array([day_mask.bit_count() for day_mask in range(len(STREAKS))])
+STREAK_TABLE = np.array(STREAKS)
+
+
+def pack(score: Score | tuple[np.ndarray, ...]):
+    """Score(s) as int64 keys that order the same way the tuples do."""
+    key = 0
+    for component in score:
+        key = (key << FIELD_BITS) + (component + FIELD_OFFSET)
+    return key
+
+
+@dataclass(frozen=True, slots=True)
+class LeafFeatures:
+    """Per index, by CompiledIndex.id: what it adds to a leaf's score."""
+
+    first_ids: tuple[int, ...]  # per course position, id of its first index
+    busy_days: np.ndarray
+    physical_days: np.ndarray
+    morning_lessons: np.ndarray
+    shortfall: np.ndarray
+
+    @classmethod
+    def compile(cls, catalog: CompiledCatalog) -> "LeafFeatures":
+        indexes = [index for course in catalog.indexes for index in course]
+        return cls(
+            first_ids=catalog.first_ids,
+            busy_days=np.array([index.busy_days for index in indexes], dtype=np.int64),
+            physical_days=np.array(
+                [index.physical_days for index in indexes], dtype=np.int64
+            ),
+            morning_lessons=np.array(
+                [index.morning_lessons for index in indexes], dtype=np.int64
+            ),
+            shortfall=np.array([not index.vacant for index in indexes], dtype=np.int64),
+        )
+
+
+@dataclass
+class LeafBatch:
+    """
+    Leaves buffered by solve instead of being visited one at a time. Each
+    buffered node has one course left: every alive index of it is a leaf.
+    """
+
+    features: LeafFeatures
+    # Per buffered node: the ids placed so far, and its busy days, morning
+    # lessons, shortfall and physical days
+    placements: list[tuple[int, ...]] = field(default_factory=list)
+    components: list[tuple[int, int, int, int]] = field(default_factory=list)
+    # Per leaf: the node it completes and the id of its last index
+    leaf_nodes: list[int] = field(default_factory=list)
+    leaf_ids: list[int] = field(default_factory=list)
+
+    def add(
+        self,
+        placed: tuple[int, ...],
+        pos: int,
+        valid: int,
+        busy_days: int,
+        morning_lessons: int,
+        shortfall: int,
+        physical_days: int,
+    ):
+        node = len(self.placements)
+        self.placements.append(placed)
+        self.components.append((busy_days, morning_lessons, shortfall, physical_days))
+        first_id = self.features.first_ids[pos]
+        for bit in bits(valid):
+            self.leaf_nodes.append(node)
+            self.leaf_ids.append(first_id + bit)
+
+    @property
+    def full(self) -> bool:
+        return len(self.leaf_ids) >= LEAF_BATCH
+
+    def flush(self, search: "Search"):
+        """Scores every buffered leaf and adds the best to search's heap."""
+        if not self.leaf_ids:
+            return
+        stats, solution_heap, features = (
+            search.stats,
+            search.solution_heap,
+            self.features,
+        )
+        components = np.array(self.components, dtype=np.int64)
+        nodes = np.array(self.leaf_nodes)
+        ids = np.array(self.leaf_ids)
+        physical_days = components[nodes, 3] | features.physical_days[ids]
+        free_day = physical_days != ALL_DAYS
+        stats.no_free_day += int(len(ids) - free_day.sum())
+        nodes, ids, physical_days = (
+            nodes[free_day],
+            ids[free_day],
+            physical_days[free_day],
+        )
+        stats.nodes += len(ids)
+        stats.depth_nodes[-1] += len(ids)
+        stats.leaves += len(ids)
+        stats.duplicates_avoided += int((DAYS - POPCOUNTS[physical_days] - 1).sum())
+        busy_days = components[nodes, 0] | features.busy_days[ids]
+        scores = (
+            -(components[nodes, 2] + features.shortfall[ids]),
+            DAYS + 1 - POPCOUNTS[busy_days],
+            STREAK_TABLE[busy_days],
+            -(components[nodes, 1] + features.morning_lessons[ids]),
+            np.full(len(ids), search.combo_aus),
+        )
+        keys = pack(scores)
+        threshold = solution_heap.threshold()
+        best = (
+            np.arange(len(ids))
+            if threshold is None
+            else np.flatnonzero(keys > pack(threshold))
+        )
+        if len(best) > solution_heap.limit:
+            best = best[np.argpartition(keys[best], -solution_heap.limit)]
+            best = best[-solution_heap.limit :]
+        for leaf in best[np.argsort(-keys[best], kind="stable")]:
+            score = tuple(int(component[leaf]) for component in scores)
+            if not solution_heap.accepts(score):
+                break
+            solution_heap.add_entry(
+                (score, (*self.placements[nodes[leaf]], int(ids[leaf])))
+            )
+        self.placements.clear()
+        self.components.clear()
+        self.leaf_nodes.clear()
+        self.leaf_ids.clear()
@@ -0,0 +1,208 @@
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from extract import Parser, file_hash
+from models import Solution
+from parallel_planner import Planner
+from replanner import Replanner
+from solution_heap import ComboHeaps, SolutionHeap
+
+
+@dataclass
+class LiveUpdate:
+    solutions: list[Solution]
+    changed: list[str]  # file names that changed since the previous update
+    seconds: float  # from noticing the change to having these solutions
+
+
+@dataclass
+class LivePlanner:
+    """
+    Keeps a plan current while StarsDownloader rewrites the pages in
+    `folder_path`. Pages are polled for changes. A new stars.html only
+    re-ranks the timetables already found. A changed course page is
+    re-extracted on its own, and only its part of the conflict tables is
+    rebuilt. Results then come from a pruned search straight away, while the
+    combinations taking that course are enumerated again in the background.
+    """
+
+    folder_path: str
+    target_courses: list[str]
+    target_num: int
+    assigned_indexes: dict[str, str] = field(default_factory=dict)
+    conflict_cache: str | None = None
+    max_workers: int | None = None
+    # Seconds between checks of the watched pages
+    poll_interval: float = 1.0
+    parser: Parser = field(init=False)
+    planner: Planner = field(init=False)
+    replanner: Replanner = field(init=False)
+    # file name -> (mtime_ns, size, content hash) as last read
+    seen: dict[str, tuple[int, int, str]] = field(init=False, default_factory=dict)
+    background: ThreadPoolExecutor = field(
+        init=False, default_factory=lambda: ThreadPoolExecutor(max_workers=1)
+    )
+    # The replanner catching up with changed courses, if it is
+    rebuilding: Future | None = field(init=False, default=None)
+    # Courses changed since the replanner last started catching up
+    stale: set[str] = field(init=False, default_factory=set)
+
+    def __post_init__(self):
+        # Every poll that finds a new stars.html waits on its extraction
+        self.parser = Parser(self.folder_path, extractor="stream")
+        self.changed_files()
+        self.parser.process_all_courses(self.target_courses)
+        self.rebuild()
+
+    def rebuild(self):
+        """Plans from scratch, for when the set of courses changes."""
+        self.planner = Planner(
+            self.parser.courses,
+            target_num=self.target_num,
+            assigned_indexes=dict(self.assigned_indexes),
+            conflict_cache=self.conflict_cache,
+            max_workers=self.max_workers,
+        )
+        # The replanner's pools start while the background thread is alive,
+        # and forking a multi-threaded process can deadlock the children
+        self.replanner = Replanner(
+            self.planner,
+            self.assigned_indexes,
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+
+    @property
+    def watched(self) -> list[str]:
+        return ["stars.html"] + [f"{code}.html" for code in self.target_courses]
+
+    def changed_files(self) -> list[str]:
+        """Watched files whose content changed since they were last seen."""
+        changed = []
+        for file_name in self.watched:
+            path = f"{self.folder_path}/{file_name}"
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            seen = self.seen.get(file_name)
+            if seen is not None and seen[:2] == (stat.st_mtime_ns, stat.st_size):
+                continue
+            # A rewrite that leaves the content as it was changes nothing
+            digest = file_hash(path)
+            self.seen[file_name] = (stat.st_mtime_ns, stat.st_size, digest)
+            if seen is None or seen[2] != digest:
+                changed.append(file_name)
+        return changed
+
+    def refresh(self, changed: list[str]) -> list[Solution]:
+        if "stars.html" in changed:
+            self.parser.vacancies = defaultdict(dict)
+            self.parser.extract_vacancy_data()
+        codes = [name.removesuffix(".html") for name in changed if name != "stars.html"]
+        extracted = []
+        for code in codes:
+            try:
+                self.parser.extract_course(code)
+            except Exception as e:
+                # Most likely still being written: read it again next poll
+                print(f"Failed to extract {code}: {e}")
+                del self.seen[f"{code}.html"]
+                continue
+            self.parser.courses[code].merge_overlapping_indexes()
+            extracted.append(code)
+        if extracted:
+            self.replace_courses(extracted)
+        if self.catch_up():
+            return self.replanner.replan(self.parser.vacancies)
+        return self.search()
+
+    def replace_courses(self, codes: list[str]):
+        if not set(codes) <= set(self.planner.problem.codes):
+            if self.rebuilding is not None:
+                self.rebuilding.result()
+                self.rebuilding = None
+            self.stale.clear()
+            self.rebuild()
+            return
+        for code in codes:
+            self.planner.pruning_grid = self.planner.pruning_grid.with_course(code)
+        self.planner.compile_problem()
+        self.stale.update(codes)
+
+    def catch_up(self) -> bool:
+        """
+        Starts the replanner on the stale courses once it is free. Returns
+        whether it is up to date with the planner.
+        """
+        if self.rebuilding is not None:
+            if not self.rebuilding.done():
+                return False
+            self.rebuilding.result()
+            self.rebuilding = None
+        if not self.stale:
+            return True
+        # The replanner takes one change at a time; courses changing while
+        # it works wait for the next one
+        self.rebuilding = self.background.submit(
+            self.replanner.replace_courses,
+            {self.planner.problem.codes.index(code) for code in self.stale},
+            self.planner.problem,
+        )
+        self.stale.clear()
+        return False
+
+    def search(self) -> list[Solution]:
+        """Top solutions under the latest snapshot, by a pruned search."""
+        problem = self.planner.problem
+        problem = problem.with_vacancies(
+            self.replanner.vacant(self.parser.vacancies, problem.catalog)
+        )
+        solution_heap = SolutionHeap(limit=self.replanner.limit)
+        # The same cap per combination as the replanner and run_planner
+        combo_heaps = ComboHeaps(self.replanner.combo_limit, solution_heap)
+        for combo in self.planner.all_combos():
+            search = problem.search(
+                combo, combo_heaps.limit, floor=solution_heap.threshold()
+            )
+            combo_heaps.add_entries(combo, search.results())
+        return problem.materialize(solution_heap.get_sorted_results())
+
+    def watch(self) -> Iterator[LiveUpdate]:
+        """
+        Yields the current solutions, then new ones each time a watched page
+        changes. Runs until the caller stops iterating.
+        """
+        yield LiveUpdate(self.replanner.replan(self.parser.vacancies), [], 0)
+        while True:
+            changed = self.changed_files()
+            if not changed:
+                self.catch_up()
+                time.sleep(self.poll_interval)
+                continue
+            start = time.perf_counter()
+            solutions = self.refresh(changed)
+            yield LiveUpdate(solutions, changed, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    live_planner = LivePlanner(
+        "mods",
+        ["AB1201", "AB1601", "AD1102", "CC0001", "SC1006", "SC2001", "SC2002"],
+        target_num=6,
+        assigned_indexes={"SC2002": "10171", "SC2001": "10254"},
+    )
+    print(f"Watching {len(live_planner.watched)} pages in mods/, Ctrl-C to stop")
+    try:
+        for update in live_planner.watch():
+            best = update.solutions[0].score if update.solutions else None
+            print(
+                f"{', '.join(update.changed) or 'start'}: best {best} "
+                f"after {update.seconds * 1000:.0f}ms"
+            )
+    except KeyboardInterrupt:
+        pass
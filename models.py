@@ -1,7 +1,16 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+
 from pydantic import BaseModel
 
 DAYS = 6  # Mon-Sat
 TIMESLOTS = 11  # 0830 - 1730
+MANDATORY = ("Tut", "Sem", "Lab")  # lesson types that need physical attendance
+
+
+def slot_bit(day: int, start: int) -> int:
+    """Bit of a (day, start_time) period in a DAYS x TIMESLOTS mask."""
+    return (day - 1) * TIMESLOTS + start - 8
 
 
 class Lesson(BaseModel):
@@ -94,3 +103,101 @@ class Solution(BaseModel):
 
     def __eq__(self, other):
         return self.score == other.score
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledIndex:
+    id: int  # position in CompiledCatalog, across all courses
+    key: str  # key in Course.indexes
+    period_mask: int  # slot_bit of every period it occupies
+    # bit (day - 1), wrapping day 0 round to bit DAYS, for each day with a
+    # mandatory lesson
+    busy_days: int
+    # bit (day - 1) for each of the DAYS days with a physical lesson
+    physical_days: int
+    morning_lessons: int  # 2 per mandatory lesson before 0930, 1 before 1030
+    vacant: bool
+
+    @classmethod
+    def compile(cls, id: int, key: str, index: Index) -> "CompiledIndex":
+        period_mask, busy_days, morning_lessons = 0, 0, 0
+        for lesson in index.lessons:
+            for day, start in lesson.periods:
+                period_mask |= 1 << slot_bit(day, start)
+            if any(m in lesson.lesson_type for m in MANDATORY):
+                busy_days |= 1 << ((lesson.day - 1) % (DAYS + 1))
+                if lesson.start < 9:
+                    morning_lessons += 2
+                elif lesson.start < 10:
+                    morning_lessons += 1
+        physical_days = 0
+        for day in range(1, DAYS + 1):
+            day_slots = ((1 << TIMESLOTS) - 1) << slot_bit(day, 8)
+            if period_mask & day_slots and index.has_physical_lesson(day):
+                physical_days |= 1 << (day - 1)
+        return cls(
+            id=id,
+            key=key,
+            period_mask=period_mask,
+            busy_days=busy_days,
+            physical_days=physical_days,
+            morning_lessons=morning_lessons,
+            vacant=index.vacant,
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledCatalog:
+    """
+    Read-only, precomputed form of a course catalog for the solver. Courses
+    are addressed by position and indexes by bit within their course.
+    """
+
+    codes: tuple[str, ...]
+    aus: tuple[int, ...]
+    index_keys: tuple[tuple[str, ...], ...]
+    indexes: tuple[tuple[CompiledIndex, ...], ...]
+    first_ids: tuple[int, ...]  # per course, the id of its first index
+
+    @classmethod
+    def compile(cls, all_courses: dict[str, Course]) -> "CompiledCatalog":
+        codes = tuple(all_courses)
+        index_keys = tuple(tuple(all_courses[code].indexes) for code in codes)
+        indexes, first_ids, next_id = [], [], 0
+        for code, keys in zip(codes, index_keys):
+            course = all_courses[code]
+            indexes.append(
+                tuple(
+                    CompiledIndex.compile(next_id + bit, key, course.indexes[key])
+                    for bit, key in enumerate(keys)
+                )
+            )
+            first_ids.append(next_id)
+            next_id += len(keys)
+        return cls(
+            codes=codes,
+            aus=tuple(all_courses[code].aus for code in codes),
+            index_keys=index_keys,
+            indexes=tuple(indexes),
+            first_ids=tuple(first_ids),
+        )
+
+    def assignment(self, placements: list[tuple[int, int]]) -> dict[str, str]:
+        """(course position, index bit) pairs as a course code -> index dict."""
+        return {self.codes[pos]: self.index_keys[pos][bit] for pos, bit in placements}
+
+    def placement(self, id: int) -> tuple[int, int]:
+        """(course position, index bit) of the index with this id."""
+        pos = bisect_right(self.first_ids, id) - 1
+        return pos, id - self.first_ids[pos]
+
+    def solution(self, score: tuple, ids: tuple[int, ...]) -> Solution:
+        assignment, vacancy_shortfall = {}, set()
+        for pos, bit in map(self.placement, ids):
+            code, index = self.codes[pos], self.indexes[pos][bit]
+            assignment[code] = index.key
+            if not index.vacant:
+                vacancy_shortfall.add((code, index.key))
+        return Solution(
+            assignment=assignment, vacancy_shortfall=vacancy_shortfall, score=score
+        )
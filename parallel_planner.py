@@ -1,13 +1,131 @@
-from collections import defaultdict
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import cProfile
+import json
+import os
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 from dataclasses import dataclass, field
+from functools import cached_property
 from itertools import combinations
+from typing import Iterator
 
 from tqdm import tqdm
 
-from models import DAYS, Course, Solution
+from models import Course, Solution
 from pruning_grid import PruningGrid, PruningList
-from solution_heap import HeapEntry, SolutionHeap
+from search_problem import Memo, Placement, SearchProblem
+from search_stats import SearchStats, TaskTiming, planner_report, timing_report
+from solution_heap import (
+    ComboHeaps,
+    HeapEntry,
+    Score,
+    SharedScore,
+    SolutionHeap,
+    combo_limit,
+)
+
+# Loaded once per worker process by _init_worker
+_problem: SearchProblem | None = None
+# Threshold of the parent's heap, raised by run_planner as results come in
+_shared_floor: SharedScore | None = None
+# Per-request state a worker keeps. Batch tasks arrive grouped by request,
+# so only the most recently used few are worth keeping
+VARIANT_CACHE = 4
+# Variants of _problem with extra vacant indexes, built on first use
+_variants: OrderedDict[tuple[Placement, ...], SearchProblem] = OrderedDict()
+# Subtrees this worker has searched, per variant, kept across tasks
+_memos: OrderedDict[tuple[Placement, ...], Memo] = OrderedDict()
+
+
+def _init_worker(shm_name: str, shared_floor: SharedScore | None):
+    global _problem, _shared_floor
+    _problem = SearchProblem.from_shared_memory(shm_name)
+    _shared_floor = shared_floor
+
+
+def _cached(cache: OrderedDict, key, build):
+    """cache[key], built on a miss; past VARIANT_CACHE entries the oldest goes."""
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    cache[key] = build()
+    if len(cache) > VARIANT_CACHE:
+        cache.popitem(last=False)
+    return cache[key]
+
+
+def _worker_task(
+    combo: tuple[int, ...],
+    prefix: tuple[Placement, ...],
+    limit: int,
+    node_budget: int,
+    floor: Score | None,
+    vacant: tuple[Placement, ...] = (),
+    memoize: bool = False,
+    profile: bool = False,
+) -> tuple[
+    list[HeapEntry], SearchStats, list[tuple[Placement, ...]], Score | None, float
+]:
+    """
+    Also returns the unexplored branches left over budget, and the score they
+    must beat to matter: anything at or below it is outside this combination's
+    top `limit` already. Indexes at `vacant` are searched as if they had
+    vacancies. With `memoize`, subtrees repeated across this worker's tasks
+    are searched once. With `profile`, the returned stats include a cProfile
+    of the search.
+    """
+    assert _problem is not None, "worker was not initialised"
+    start = time.perf_counter()
+    problem = _problem
+    if vacant:
+        problem = _cached(_variants, vacant, lambda: _problem.with_vacant(vacant))
+    memo = _cached(_memos, vacant, dict) if memoize else None
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    search = problem.search(
+        combo,
+        limit,
+        prefix,
+        node_budget,
+        floor,
+        _shared_floor,
+        memo,
+        batch_leaves=problem.leaf_features is not None,
+    )
+    if profiler is not None:
+        profiler.disable()
+        search.stats.add_profile(profiler)
+    return (
+        search.results(),
+        search.stats,
+        search.deferred,
+        search.solution_heap.threshold(),
+        time.perf_counter() - start,
+    )
+
+
+@dataclass
+class PlannerProgress:
+    """Snapshot of a running search, yielded by Planner.iter_planner."""
+
+    entries: list[HeapEntry]  # best so far, best first
+    problem: SearchProblem
+    improved: bool  # whether the last task changed `entries`
+    nodes: int
+    combos_done: int
+    combos_total: int
+    elapsed: float
+    finished: bool = False
+    stopped: bool = False  # finished early on a time or node limit
+
+    @property
+    def best_score(self) -> Score | None:
+        return self.entries[0][0] if self.entries else None
+
+    @cached_property
+    def solutions(self) -> list[Solution]:
+        return self.problem.materialize(self.entries)
 
 
 @dataclass
@@ -16,9 +134,27 @@ class Planner:
     target_num: int
     assigned_indexes: dict[str, str] = field(default_factory=dict)
     pruned_indexes: PruningList = field(default_factory=lambda: defaultdict(set))
+    # Where to save/load the conflict table; None always rebuilds it
+    conflict_cache: str | None = None
+    # A task that visits more nodes than this hands its unexplored branches
+    # back as subtasks, so idle workers can pick up part of a large search
+    node_budget: int = 20_000
+    max_workers: int | None = None
+    # Reuse search results for subtrees repeated across combinations
+    memoize: bool = False
+    # Score leaves in NumPy batches rather than one at a time
+    batch_leaves: bool = False
+    # Run every task under cProfile and add the results to the report
+    profile: bool = False
+    # Where run_planner writes its JSON report; None only keeps it in `report`
+    report_path: str | None = None
     unassigned_courses: set[str] = field(init=False)
     pruning_grid: PruningGrid = field(init=False)
     solution_heap: SolutionHeap = field(init=False)
+    problem: SearchProblem = field(init=False)
+    stats: SearchStats = field(init=False, default_factory=SearchStats)
+    task_timings: list[TaskTiming] = field(init=False, default_factory=list)
+    report: dict = field(init=False, default_factory=dict)
 
     def __post_init__(self):
         # for course_code, index in self.assigned_indexes.items():
@@ -32,122 +168,217 @@ class Planner:
         self.unassigned_courses = set(
             c for c in self.all_courses  # if c not in self.assigned_indexes
         )
-        # prune indexes which clash with assigned indexes
-        self.pruning_grid = PruningGrid.construct(self.all_courses)
         for course_code, index in self.assigned_indexes.items():
             self.all_courses[course_code].get_index(index).vacancies += 1
+        # prune indexes which clash with assigned indexes
+        # (built after the vacancy bump, since the compiled catalog snapshots it)
+        self.pruning_grid = PruningGrid.load_or_construct(
+            self.all_courses, self.conflict_cache
+        )
 
         self.assigned_indexes = {}
 
-        # clashing = self.pruning_grid.clashing_indexes(
-        #     self.all_courses[course_code].indexes[index]
-        # )
-        # self.pruned_indexes = PruningGrid.add_new_pruned(
-        #     clashing, self.pruned_indexes
-        # )
-        self.solution_heap = SolutionHeap(self.all_courses, self.assigned_indexes)
-
-    def mrv(
-        self, combo: set[str], unassigned_courses: set[str], pruned_indexes: PruningList
-    ) -> str:
-        mrv, min_remaining = "", float("inf")
-        for course_code in unassigned_courses & combo:
-            num_indexes = len(self.all_courses[course_code].indexes)
-            num_pruned = len(pruned_indexes[course_code])
-            if num_indexes - num_pruned < min_remaining:
-                min_remaining = num_indexes - num_pruned
-                mrv = course_code
-        return mrv
-
-    def solve(
-        self,
-        combo: set[str],
-        assigned_indexes: dict[str, str],
-        unassigned_courses: set[str],
-        pruned_indexes: PruningList,
-        solution_heap: SolutionHeap,
-    ):
-        if len(assigned_indexes) == self.target_num:
-            solution_heap.add_assignment(assigned_indexes.copy())
-            return
-        course_code = self.mrv(combo, unassigned_courses, pruned_indexes)
-        course_indexes = self.all_courses[course_code].indexes
-        valid_indexes = set(course_indexes.keys()) - pruned_indexes[course_code]
-        unassigned_courses.remove(course_code)
-        for index in valid_indexes:
-            clashing = self.pruning_grid.clashing_indexes(course_indexes[index])
-            new_pruned = self.pruning_grid.get_new_pruned(clashing, pruned_indexes)
-            pruned_indexes = self.pruning_grid.add_new_pruned(
-                new_pruned, pruned_indexes
-            )
-            assigned_indexes[course_code] = index
-            self.solve(
-                combo,
-                assigned_indexes,
-                unassigned_courses,
-                pruned_indexes,
-                solution_heap,
-            )
-            del assigned_indexes[course_code]
-            pruned_indexes = self.pruning_grid.remove_new_pruned(
-                new_pruned, pruned_indexes
+        self.solution_heap = SolutionHeap()
+        self.compile_problem()
+
+    def compile_problem(self):
+        """Builds the search problem from the current pruning grid."""
+        self.problem = SearchProblem.compile(self.pruning_grid, self.pruned_indexes)
+        if self.batch_leaves:
+            self.problem = self.problem.with_leaf_features()
+
+    def all_combos(self) -> tuple[tuple[int, ...], ...]:
+        """Course positions of every combination of courses to search."""
+        return tuple(
+            combinations(
+                sorted(self.problem.positions(self.unassigned_courses)),
+                self.target_num - len(self.assigned_indexes),
             )
-        unassigned_courses.add(course_code)
+        )
 
-    def worker_task(self, combo: set[str], limit: int) -> list[Solution]:
+    def run_planner(
+        self, time_limit: float | None = None, max_nodes: int | None = None
+    ) -> list[Solution]:
+        for progress in self.iter_planner(time_limit, max_nodes):
+            pass
+        return progress.solutions
+
+    def iter_planner(
+        self, time_limit: float | None = None, max_nodes: int | None = None
+    ) -> Iterator[PlannerProgress]:
         """
-        Standalone function to handle a single combination.
-        This runs in a separate process.
+        Yields a PlannerProgress each time a task finishes, ending with one
+        whose `finished` is set. Once `time_limit` seconds have passed or
+        `max_nodes` nodes have been searched, tasks not yet started are
+        cancelled and the best solutions found so far are returned.
         """
-        local_solutions = SolutionHeap(
-            self.all_courses, self.assigned_indexes, limit=limit
+        all_combos = self.all_combos()
+        limit = combo_limit(len(all_combos))
+        # A combination split into subtasks still brings at most `limit`
+        combo_heaps = ComboHeaps(limit, self.solution_heap)
+        # Workers load the problem once from shared memory instead of
+        # unpickling the whole Planner for every combination
+        shm = self.problem.to_shared_memory()
+        # Nothing at or below the parent heap's threshold can make the final
+        # results, so workers prune against it as well as their own heaps
+        shared_floor = SharedScore()
+        start = time.perf_counter()
+        # Tasks still queued or running for each combination
+        open_tasks: Counter[tuple[int, ...]] = Counter()
+        # Combinations with a task that failed or a subtask dropped on stopping,
+        # which never count as done
+        incomplete: set[tuple[int, ...]] = set()
+        combos_done, stopped = 0, False
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_worker,
+                initargs=(shm.name, shared_floor),
+            ) as executor:
+                pending: dict[Future, tuple] = {}
+
+                def submit(
+                    combo: tuple[int, ...],
+                    prefix: tuple[Placement, ...],
+                    floor: Score | None,
+                ):
+                    future = executor.submit(
+                        _worker_task,
+                        combo,
+                        prefix,
+                        limit,
+                        self.node_budget,
+                        floor,
+                        (),
+                        self.memoize,
+                        self.profile,
+                    )
+                    pending[future] = (combo, prefix)
+                    open_tasks[combo] += 1
+
+                for combo in all_combos:
+                    submit(combo, (), None)
+                progress = tqdm(total=len(all_combos), desc="Parallel Scanning")
+                try:
+                    while pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            combo, prefix = pending.pop(future)
+                            try:
+                                entries, stats, deferred, floor, seconds = (
+                                    future.result()
+                                )
+                            except Exception as exc:
+                                print(f"Combination generated an exception: {exc}")
+                                open_tasks[combo] -= 1
+                                incomplete.add(combo)
+                                progress.update()
+                                continue
+                            improved = combo_heaps.add_entries(combo, entries)
+                            threshold = self.solution_heap.threshold()
+                            if threshold is not None:
+                                shared_floor.raise_to(threshold)
+                            self.stats.merge(stats)
+                            self.task_timings.append(
+                                self.task_timing(combo, prefix, seconds, stats)
+                            )
+                            if not stopped:
+                                for subtask in deferred:
+                                    submit(combo, subtask, floor)
+                                progress.total += len(deferred)
+                            elif deferred:
+                                incomplete.add(combo)
+                            open_tasks[combo] -= 1
+                            if not open_tasks[combo] and combo not in incomplete:
+                                combos_done += 1
+                            progress.update()
+                            yield PlannerProgress(
+                                entries=self.solution_heap.get_sorted_results(),
+                                problem=self.problem,
+                                improved=improved,
+                                nodes=self.stats.nodes,
+                                combos_done=combos_done,
+                                combos_total=len(all_combos),
+                                elapsed=time.perf_counter() - start,
+                            )
+                        if not stopped and self.over_budget(
+                            start, time_limit, max_nodes
+                        ):
+                            # Running tasks stop within node_budget nodes
+                            stopped = True
+                            for future in pending:
+                                future.cancel()
+                            pending = {
+                                future: task
+                                for future, task in pending.items()
+                                if not future.cancelled()
+                            }
+                except GeneratorExit:
+                    # The caller stopped iterating; don't wait for queued tasks
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+                progress.close()
+        finally:
+            shm.close()
+            shm.unlink()
+        wall = time.perf_counter() - start
+        workers = self.max_workers or os.cpu_count() or 1
+        print(f"Search stats: {self.stats.summary()}")
+        print(timing_report(self.task_timings, wall, workers))
+        self.report = planner_report(self.stats, self.task_timings, wall, workers)
+        if self.report_path is not None:
+            with open(self.report_path, "w", encoding="utf-8") as f:
+                json.dump(self.report, f, indent=2)
+        yield PlannerProgress(
+            entries=self.solution_heap.get_sorted_results(),
+            problem=self.problem,
+            improved=False,
+            nodes=self.stats.nodes,
+            combos_done=combos_done,
+            combos_total=len(all_combos),
+            elapsed=wall,
+            finished=True,
+            stopped=stopped,
         )
 
-        for day in range(DAYS):
-            clashing = self.pruning_grid.prune_day(day + 1)
-            new_pruned = self.pruning_grid.get_new_pruned(clashing, self.pruned_indexes)
-            pruned = self.pruning_grid.add_new_pruned(
-                new_pruned, self.pruned_indexes.copy()
-            )
-            self.solve(
-                combo,
-                self.assigned_indexes.copy(),
-                self.unassigned_courses.copy(),
-                pruned,
-                local_solutions,
-            )
-            pruned = self.pruning_grid.remove_new_pruned(new_pruned, pruned)
-        return local_solutions.get_sorted_results()
+    def over_budget(
+        self, start: float, time_limit: float | None, max_nodes: int | None
+    ) -> bool:
+        if time_limit is not None and time.perf_counter() - start >= time_limit:
+            return True
+        return max_nodes is not None and self.stats.nodes >= max_nodes
 
-    def run_planner(self) -> list[Solution]:
-        all_combos = tuple(
-            combinations(
-                self.unassigned_courses, self.target_num - len(self.assigned_indexes)
-            )
+    def task_timing(
+        self,
+        combo: tuple[int, ...],
+        prefix: tuple[Placement, ...],
+        seconds: float,
+        stats: SearchStats,
+    ) -> TaskTiming:
+        codes, index_keys = self.problem.codes, self.problem.index_keys
+        return TaskTiming(
+            combo=tuple(codes[pos] for pos in combo),
+            prefix=tuple((codes[pos], index_keys[pos][bit]) for pos, bit in prefix),
+            seconds=seconds,
+            nodes=stats.nodes,
         )
-        with ProcessPoolExecutor() as executor:
-            futures = {
-                executor.submit(
-                    self.worker_task, set(combo), max(10, 50 // len(all_combos))
-                ): combo
-                for combo in all_combos
-            }
-            for future in tqdm(
-                as_completed(futures), total=len(all_combos), desc="Parallel Scanning"
-            ):
-                try:
-                    found_sols = future.result()
-                    for sol in found_sols:
-                        self.solution_heap.add_solution(sol)
-                except Exception as exc:
-                    print(f"Combination generated an exception: {exc}")
-        return self.solution_heap.get_sorted_results()
 
 
 if __name__ == "__main__":
+    import argparse
+
     from extract import Parser
     from ui import TimetableGUI
 
+    arg_parser = argparse.ArgumentParser(description="Plan a timetable.")
+    arg_parser.add_argument(
+        "--time-limit",
+        type=float,
+        default=None,
+        help="seconds after which to stop with the best found so far",
+    )
+    args = arg_parser.parse_args()
+
     target_courses = [
         "AB1201",
         "AB1601",
@@ -160,7 +391,7 @@ if __name__ == "__main__":
         "SC2006",
         "SC2008",
     ]
-    parser = Parser("mods")
+    parser = Parser("mods", cache_path="mods/parsed.json")
     parser.process_all_courses(target_courses)
     assigned_indexes = {
         "SC2002": "10171",
@@ -169,8 +400,16 @@ if __name__ == "__main__":
         "AB1601": "00871",
         "AD1102": "00109",
     }
-    planner = Planner(parser.courses, target_num=7, assigned_indexes=assigned_indexes)
-    solutions = planner.run_planner()
+    planner = Planner(
+        parser.courses,
+        target_num=7,
+        assigned_indexes=assigned_indexes,
+        conflict_cache="mods/conflicts.json",
+    )
+    for progress in planner.iter_planner(time_limit=args.time_limit):
+        if progress.improved:
+            print(f"{progress.elapsed:.2f}s: best so far {progress.best_score}")
+    solutions = progress.solutions
     if solutions:
         TimetableGUI(solutions, parser.courses)
     else:
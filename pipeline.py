@@ -0,0 +1,135 @@
+import os
+import time
+from dataclasses import dataclass, field
+
+from extract import Parser
+from models import Solution
+from parallel_planner import Planner
+from stars_downloader import StarsDownloader, stale_courses
+from stars_fetcher import CourseFetcher
+
+
+@dataclass
+class PipelineRun:
+    solutions: list[Solution]
+    # Courses whose pages could not be downloaded; any with a page saved
+    # earlier are planned from that
+    failed: list[str]
+    # Seconds from the start until the last page landed, the last page was
+    # parsed, and the solutions were ready
+    fetched: float
+    parsed: float
+    planned: float
+
+
+@dataclass
+class Pipeline:
+    """
+    Downloads, parses and plans in one run. Each course page is handed to the
+    parser as soon as its download lands, so by the time the last page is in
+    the others are parsed already, and planning starts straight after.
+    """
+
+    folder_path: str
+    target_courses: list[str]
+    target_num: int
+    assigned_indexes: dict[str, str] = field(default_factory=dict)
+    conflict_cache: str | None = None
+    # Parser cache, so pages downloaded again unchanged are not parsed again
+    cache_path: str | None = None
+    # Saved pages younger than this many seconds are not downloaded again
+    max_age: float = 3600
+    # Parse in a process pool rather than as each page lands
+    parallel: bool = False
+    max_workers: int | None = None
+
+    def run(self, fetcher: CourseFetcher) -> PipelineRun:
+        """
+        Plans from the saved stars.html and the course pages, downloading
+        the stale ones with `fetcher` on the way.
+        """
+        start = time.perf_counter()
+        parser = Parser(
+            self.folder_path,
+            cache_path=self.cache_path,
+            extractor="stream",
+            parallel=self.parallel,
+            max_workers=self.max_workers,
+        )
+        parser.load_cache()
+        # Course vacancies are filled in from stars.html as each one is loaded
+        parser.extract_vacancy_data()
+        stale = stale_courses(self.folder_path, self.target_courses, self.max_age)
+        fetching = fetcher.iter_fetch(stale)
+        failed, fetched = [], 0.0
+
+        def landed():
+            nonlocal fetched
+            # Fresh pages are parsed while the first downloads are under way
+            yield from (code for code in self.target_courses if code not in stale)
+            for code, saved in fetching:
+                fetched = time.perf_counter() - start
+                if not saved:
+                    failed.append(code)
+                # A stale page still beats planning without the course
+                if saved or os.path.exists(f"{self.folder_path}/{code}.html"):
+                    yield code
+
+        parser.extract_as_fetched(landed())
+        parsed = time.perf_counter() - start
+        parser.save_cache()
+
+        # In target order, so course positions don't depend on download timing
+        courses = {
+            code: parser.courses[code]
+            for code in self.target_courses
+            if code in parser.courses
+        }
+        for course in courses.values():
+            course.merge_overlapping_indexes()
+        planner = Planner(
+            courses,
+            target_num=self.target_num,
+            assigned_indexes=dict(self.assigned_indexes),
+            conflict_cache=self.conflict_cache,
+            max_workers=self.max_workers,
+        )
+        solutions = planner.run_planner()
+        return PipelineRun(
+            solutions, failed, fetched, parsed, time.perf_counter() - start
+        )
+
+
+if __name__ == "__main__":
+    target_courses = [
+        "AB1201",
+        "AB1601",
+        "AD1102",
+        "CC0001",
+        "SC1006",
+        "SC2001",
+        "SC2002",
+    ]
+    pipeline = Pipeline(
+        "mods",
+        target_courses,
+        target_num=6,
+        assigned_indexes={"SC2002": "10171", "SC2001": "10254"},
+        conflict_cache="mods/conflicts.json",
+        cache_path="mods/parsed.json",
+    )
+    downloader = StarsDownloader(headless=True)
+    if downloader.login():
+        fetcher = CourseFetcher.from_downloader(downloader, target_courses)
+        # Fresh vacancies for every course, now that all are in the planner
+        downloader.download_stars_page()
+        run = pipeline.run(fetcher)
+        print(
+            f"Last page in after {run.fetched:.2f}s, parsed by {run.parsed:.2f}s, "
+            f"planned by {run.planned:.2f}s"
+        )
+        if run.failed:
+            print(f"Could not download: {', '.join(run.failed)}")
+        for solution in run.solutions[:5]:
+            print(solution)
+    downloader.quit()
@@ -1,83 +1,184 @@
+import hashlib
+import json
+import os
 from collections import defaultdict
 from dataclasses import dataclass
+from typing import Iterator
 
-from models import DAYS, TIMESLOTS, Course, Index, Lesson
+from models import DAYS, TIMESLOTS, CompiledCatalog, Course
 
 type PruningList = defaultdict[str, set[str]] | dict[str, set[str]]
+# Per course position, bit i is set while index_keys[pos][i] is still valid
+type AliveMasks = list[int]
+
+
+def bits(mask: int) -> Iterator[int]:
+    """Yields the positions of the set bits in mask, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
 
 
 @dataclass
 class PruningGrid:
     all_courses: dict[str, Course]
-    # 2D grid of sets of (course_code, index)
-    grid: tuple[tuple[frozenset[tuple[str, str]]]]
+    catalog: CompiledCatalog
+    # Per slot bit, per course: mask of the indexes occupying that slot
+    slot_masks: tuple[tuple[int, ...], ...]
+    # Per course, per index, per other course: mask of the clashing indexes
+    conflicts: tuple[tuple[tuple[int, ...], ...], ...]
 
     @classmethod
     def construct(cls, all_courses: dict[str, Course]) -> "PruningGrid":
-        grid = [[[] for slot in range(TIMESLOTS)] for day in range(DAYS)]
-        for code, course in all_courses.items():
-            for idx, index in course.indexes.items():
-                for lesson in index.lessons:
-                    for day, start in lesson.periods:
-                        slot = grid[day - 1][start - 8]
-                        slot.append((code, idx))
-        frozen_grid = tuple(tuple(frozenset(slot) for slot in day) for day in grid)
-        return cls(all_courses, frozen_grid)  # type: ignore
-
-    def slot(self, day: int, start: int) -> frozenset:
-        if day < 1 or day > DAYS or start < 8 or start >= 8 + TIMESLOTS:
-            raise ValueError("Invalid day or start time for slot retrieval.")
-        return self.grid[day - 1][start - 8]
-
-    def clashing_indexes(self, index: Index) -> PruningList:
-
-        indexes = defaultdict(set)
-        for lesson in index.lessons:
-            for day, start in lesson.periods:
-                slot = self.slot(day, start)
-                for code, index in slot:
-                    indexes[code].add(index)
-        return indexes
-
-    def prune_day(self, day: int) -> PruningList:
-        indexes = defaultdict(set)
-        for start in range(8, 8 + TIMESLOTS):
-            slot = self.slot(day, start)
-            for code, index in slot:
-                if self.all_courses[code].get_index(index).has_physical_lesson(day):
-                    indexes[code].add(index)
-        return indexes
+        catalog = CompiledCatalog.compile(all_courses)
+        codes, occupancy = catalog.codes, cls.occupancy_of(catalog)
+        slot_masks = [[0] * len(codes) for _ in range(DAYS * TIMESLOTS)]
+        for pos, masks in enumerate(occupancy):
+            for bit, occupied in enumerate(masks):
+                for slot in bits(occupied):
+                    slot_masks[slot][pos] |= 1 << bit
+        conflicts = tuple(
+            tuple(
+                cls.clashes_with(occupied, slot_masks, len(codes)) for occupied in masks
+            )
+            for masks in occupancy
+        )
+        return cls(
+            all_courses,
+            catalog,
+            tuple(tuple(row) for row in slot_masks),
+            conflicts,
+        )
+
+    def with_course(self, code: str) -> "PruningGrid":
+        """
+        Copy for all_courses[code] having changed, already in all_courses,
+        with only that course's row and column of the tables rebuilt.
+        """
+        catalog = CompiledCatalog.compile(self.all_courses)
+        pos, occupancy = catalog.codes.index(code), self.occupancy_of(catalog)
+        slot_masks = [list(row) for row in self.slot_masks]
+        for row in slot_masks:
+            row[pos] = 0
+        for bit, occupied in enumerate(occupancy[pos]):
+            for slot in bits(occupied):
+                slot_masks[slot][pos] |= 1 << bit
+        conflicts = list(self.conflicts)
+        conflicts[pos] = tuple(
+            self.clashes_with(occupied, slot_masks, len(catalog.codes))
+            for occupied in occupancy[pos]
+        )
+        for other, masks in enumerate(occupancy):
+            if other == pos:
+                continue
+            rows = []
+            for occupied, row in zip(masks, self.conflicts[other]):
+                clashing = 0
+                for slot in bits(occupied):
+                    clashing |= slot_masks[slot][pos]
+                rows.append(row[:pos] + (clashing,) + row[pos + 1 :])
+            conflicts[other] = tuple(rows)
+        return PruningGrid(
+            self.all_courses,
+            catalog,
+            tuple(tuple(row) for row in slot_masks),
+            tuple(conflicts),
+        )
 
     @staticmethod
-    def get_new_pruned(
-        clashing: PruningList, pruned_indexes: PruningList
-    ) -> PruningList:
-        new_pruned = {idx: clashing[idx] - pruned_indexes[idx] for idx in clashing}
-        return new_pruned
+    def clashes_with(
+        occupied: int, slot_masks: list[list[int]], num_courses: int
+    ) -> tuple[int, ...]:
+        clashing = [0] * num_courses
+        for slot in bits(occupied):
+            for other, mask in enumerate(slot_masks[slot]):
+                clashing[other] |= mask
+        return tuple(clashing)
 
     @staticmethod
-    def add_new_pruned(
-        new_pruned: PruningList, pruned_indexes: PruningList
-    ) -> PruningList:
-        for idx in new_pruned:
-            pruned_indexes[idx] |= new_pruned[idx]
-        return pruned_indexes
+    def fingerprint(all_courses: dict[str, Course]) -> str:
+        """Hash of everything the conflict table depends on (not vacancies)."""
+        schedules = [
+            (code, [(idx, index.schedule) for idx, index in course.indexes.items()])
+            for code, course in all_courses.items()
+        ]
+        return hashlib.sha256(json.dumps(schedules).encode()).hexdigest()
+
+    def save(self, path: str):
+        data = {
+            "fingerprint": self.fingerprint(self.all_courses),
+            "slot_masks": self.slot_masks,
+            "conflicts": self.conflicts,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path: str, all_courses: dict[str, Course]) -> "PruningGrid | None":
+        """Returns None if there is no saved table for these courses."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data["fingerprint"] != cls.fingerprint(all_courses):
+            return None
+        return cls(
+            all_courses,
+            CompiledCatalog.compile(all_courses),
+            tuple(tuple(row) for row in data["slot_masks"]),
+            tuple(tuple(tuple(row) for row in course) for course in data["conflicts"]),
+        )
+
+    @classmethod
+    def load_or_construct(
+        cls, all_courses: dict[str, Course], path: str | None = None
+    ) -> "PruningGrid":
+        if path is None:
+            return cls.construct(all_courses)
+        pruning_grid = cls.load(path, all_courses)
+        if pruning_grid is None:
+            pruning_grid = cls.construct(all_courses)
+            pruning_grid.save(path)
+        return pruning_grid
 
     @staticmethod
-    def remove_new_pruned(
-        new_pruned: PruningList, pruned_indexes: PruningList
-    ) -> PruningList:
-        for idx in new_pruned:
-            pruned_indexes[idx] -= new_pruned[idx]
-        return pruned_indexes
+    def occupancy_of(catalog: CompiledCatalog) -> tuple[tuple[int, ...], ...]:
+        return tuple(
+            tuple(index.period_mask for index in indexes) for indexes in catalog.indexes
+        )
+
+    @property
+    def codes(self) -> tuple[str, ...]:
+        return self.catalog.codes
+
+    @property
+    def index_keys(self) -> tuple[tuple[str, ...], ...]:
+        return self.catalog.index_keys
+
+    def full_masks(self) -> AliveMasks:
+        return [(1 << len(keys)) - 1 for keys in self.index_keys]
+
+    def masks_from_pruning(self, pruned_indexes: PruningList) -> AliveMasks:
+        alive = self.full_masks()
+        for pos, code in enumerate(self.codes):
+            for bit, idx in enumerate(self.index_keys[pos]):
+                if idx in pruned_indexes.get(code, ()):
+                    alive[pos] &= ~(1 << bit)
+        return alive
 
 
 if __name__ == "__main__":
     from extract import Parser
 
     parser = Parser("mods")
-    parser.process_all_courses(["SC2001"])
-    lesson = Lesson(lesson_type="Lec", day=3, start=10, duration=2)
-    print(parser.courses["SC2001"].indexes)
+    parser.process_all_courses(["SC2001", "SC2002"])
     pg = PruningGrid.construct(parser.courses)
-    print(pg.prune_day(3))
+    for pos, code in enumerate(pg.codes):
+        clashes = sum(
+            mask.bit_count()
+            for masks in pg.conflicts[pos]
+            for other, mask in enumerate(masks)
+            if other != pos
+        )
+        print(f"{code}: {len(pg.index_keys[pos])} indexes, {clashes} clashes")
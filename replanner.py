@@ -0,0 +1,280 @@
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from multiprocessing.context import BaseContext
+from typing import Iterable
+
+import numpy as np
+
+from extract import get_vacancies
+from leaf_batch import FIELD_BITS, pack
+from models import CompiledCatalog, Solution
+from parallel_planner import Planner, _init_worker, _worker_task
+from search_problem import SearchProblem
+from solution_heap import HeapEntry, combo_limit
+
+# A search limit no heap reaches, so nothing is ever pruned
+EVERY_TIMETABLE = sys.maxsize
+# A snapshot touching more than 1/REBUILD_SHARE of the timetables recounts
+# every shortfall rather than patching the ones touched
+REBUILD_SHARE = 8
+
+
+@dataclass
+class Replanner:
+    """
+    Re-ranks a Planner's timetables for a new vacancy snapshot without
+    searching again. Vacancies only decide the shortfall component of a
+    score, never which timetables are feasible, so every feasible timetable
+    is enumerated once and kept as its index ids and the components that
+    don't depend on vacancies.
+    """
+
+    planner: Planner
+    # Indexes already held; they never count as shortfall, whatever the snapshot
+    assigned_indexes: dict[str, str] = field(default_factory=dict)
+    limit: int = 50
+    # Start method of the enumeration pools; None for the platform default
+    mp_context: BaseContext | None = None
+    # Most timetables taking the same courses that make the top `limit`,
+    # as in Planner.run_planner
+    combo_limit: int = field(init=False)
+    # Per course taken, per feasible timetable: its CompiledIndex id
+    ids: np.ndarray = field(init=False)
+    # Per feasible timetable: a label shared by those taking the same courses
+    combos: np.ndarray = field(init=False)
+    # Per feasible timetable: free days, longest free streak, -morning
+    # lessons and aus, the score components after -shortfall
+    components: np.ndarray = field(init=False)
+    # Per feasible timetable: its score packed as if nothing were short
+    base_keys: np.ndarray = field(init=False)
+    # The timetables taking index id i are rows[starts[i] : starts[i + 1]]
+    rows: np.ndarray = field(init=False)
+    starts: np.ndarray = field(init=False)
+    # As of the latest snapshot: per index id, 1 if it is short of a
+    # vacancy, and per feasible timetable its shortfall and packed score
+    short: np.ndarray = field(init=False)
+    shortfall: np.ndarray = field(init=False)
+    keys: np.ndarray = field(init=False)
+    # The planner's problem, with the vacancies of the latest snapshot
+    problem: SearchProblem = field(init=False)
+    enumerate_seconds: float = field(init=False)
+
+    def __post_init__(self):
+        self.problem = self.planner.problem
+        all_combos = self.planner.all_combos()
+        self.combo_limit = combo_limit(len(all_combos))
+        start = time.perf_counter()
+        ids, components = self.enumerate(all_combos)
+        self.enumerate_seconds = time.perf_counter() - start
+        self.index(ids, components)
+
+    def index(self, ids: np.ndarray, components: np.ndarray):
+        """Takes these timetables, none of them short of a vacancy yet."""
+        self.ids, self.components = ids, components
+        courses = np.searchsorted(self.problem.catalog.first_ids, ids, side="right")
+        _, combos = np.unique(courses, axis=1, return_inverse=True)
+        self.combos = combos.ravel()
+        self.base_keys = pack((0, *components.T))
+        num_ids = sum(len(course) for course in self.problem.catalog.indexes)
+        flat = ids.ravel()
+        order = np.argsort(flat, kind="stable")
+        self.rows = (order % max(ids.shape[1], 1)).astype(np.int32)
+        self.starts = np.searchsorted(flat[order], np.arange(num_ids + 1))
+        self.short = np.zeros(num_ids, dtype=np.int8)
+        self.shortfall = np.zeros(ids.shape[1], dtype=np.int8)
+        self.keys = self.base_keys.copy()
+
+    def replace_courses(self, positions: set[int], problem: SearchProblem):
+        """
+        Switches to `problem`, in which only the courses at `positions`
+        changed, and enumerates again only the combinations taking one of
+        them. The next replan rescores every timetable. Nothing changes until
+        the new timetables are in, so other threads can keep calling `vacant`.
+        """
+        old_first = np.array(self.problem.catalog.first_ids)
+        offsets = np.array(problem.catalog.first_ids) - old_first
+        courses = np.searchsorted(old_first, self.ids, side="right") - 1
+        keep = ~np.isin(courses, list(positions)).any(axis=0)
+        # Ids of the unchanged courses move with the changed courses' sizes
+        ids = (self.ids + offsets[courses])[:, keep].astype(np.int32)
+        new_ids, new_components = self.enumerate(
+            [
+                combo
+                for combo in self.planner.all_combos()
+                if not positions.isdisjoint(combo)
+            ],
+            problem,
+        )
+        self.problem = problem
+        self.index(
+            np.concatenate([ids, new_ids], axis=1),
+            np.concatenate([self.components[keep], new_components]),
+        )
+
+    def enumerate(
+        self, combos: Iterable[tuple[int, ...]], problem: SearchProblem | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Every feasible timetable of `problem`, by default the current one,
+        taking the courses of one of `combos`: its sorted ids, a column per
+        course, and its score components.
+        """
+        planner = self.planner
+        entries: list[HeapEntry] = []
+        shm = (problem or self.problem).to_shared_memory()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=planner.max_workers,
+                mp_context=self.mp_context,
+                initializer=_init_worker,
+                initargs=(shm.name, None),
+            ) as executor:
+
+                def submit(combo, prefix):
+                    future = executor.submit(
+                        _worker_task,
+                        combo,
+                        prefix,
+                        EVERY_TIMETABLE,
+                        planner.node_budget,
+                        None,
+                    )
+                    pending[future] = combo
+
+                pending = {}
+                for combo in combos:
+                    submit(combo, ())
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        combo = pending.pop(future)
+                        combo_entries, stats, deferred, _, _ = future.result()
+                        entries += combo_entries
+                        planner.stats.merge(stats)
+                        for prefix in deferred:
+                            submit(combo, prefix)
+        finally:
+            shm.close()
+            shm.unlink()
+        ids = np.array([ids for _, ids in entries], dtype=np.int32)
+        ids = np.sort(ids.reshape(-1, planner.target_num), axis=1)
+        components = np.array([score[1:] for score, _ in entries], dtype=np.int64)
+        return np.ascontiguousarray(ids.T), components.reshape(-1, 4)
+
+    def vacant(
+        self,
+        vacancies: dict[str, dict[str, int]],
+        catalog: CompiledCatalog | None = None,
+    ) -> list[list[bool]]:
+        """
+        Per course position and index bit of `catalog`, by default the
+        current one, whether the snapshot has room.
+        """
+        all_courses, catalog = self.planner.all_courses, catalog or self.problem.catalog
+        held = {
+            (code, all_courses[code].get_index_key(idx))
+            for code, idx in self.assigned_indexes.items()
+        }
+        return [
+            [
+                (code, key) in held
+                or sum(get_vacancies(vacancies, code, i) for i in key.split("/")) > 0
+                for key in keys
+            ]
+            for code, keys in zip(catalog.codes, catalog.index_keys)
+        ]
+
+    def replan(self, vacancies: dict[str, dict[str, int]]) -> list[Solution]:
+        """
+        Top solutions under a snapshot like Parser.vacancies. Only the
+        timetables taking an index whose vacancy flipped are rescored.
+        """
+        self.problem = self.problem.with_vacancies(self.vacant(vacancies))
+        catalog = self.problem.catalog
+        short = np.array(
+            [not index.vacant for course in catalog.indexes for index in course],
+            dtype=np.int8,
+        )
+        changed = np.flatnonzero(short != self.short)
+        counts = self.starts[changed + 1] - self.starts[changed]
+        if counts.sum() * REBUILD_SHARE > len(self.shortfall):
+            self.shortfall[:] = 0
+            for column in self.ids:
+                self.shortfall += short[column]
+            rows = slice(None)
+        elif len(changed):
+            rows = np.concatenate(
+                [self.rows[self.starts[id] : self.starts[id + 1]] for id in changed]
+            )
+            deltas = np.repeat(short[changed] - self.short[changed], counts)
+            np.add.at(self.shortfall, rows, deltas)
+        else:
+            rows = slice(0)
+        # -shortfall leads the packed score
+        self.keys[rows] = self.base_keys[rows] - (
+            self.shortfall[rows].astype(np.int64) << (4 * FIELD_BITS)
+        )
+        self.short = short
+        return self.problem.materialize(self.best())
+
+    def best(self) -> list[HeapEntry]:
+        """
+        The top `limit` timetables as of the latest snapshot, like a full
+        heap, with at most `combo_limit` taking the same courses.
+        """
+        keys, size = self.keys, self.limit
+        while True:
+            rows = np.arange(len(keys))
+            if len(keys) > size:
+                # Every timetable tied with the size-th best, to break ties by ids
+                kth = np.partition(keys, -size)[-size]
+                rows = np.flatnonzero(keys >= kth)
+            order = np.lexsort((*self.ids[::-1, rows], keys[rows]))
+            best, taken = [], Counter()
+            for row in rows[order[::-1]]:
+                if taken[self.combos[row]] < self.combo_limit:
+                    taken[self.combos[row]] += 1
+                    best.append(row)
+                    if len(best) == self.limit:
+                        break
+            # Past the capped combinations, look further down the ranking
+            if len(best) == self.limit or len(rows) == len(keys):
+                break
+            size *= 2
+        return [
+            (
+                (-int(self.shortfall[row]), *map(int, self.components[row])),
+                tuple(map(int, self.ids[:, row])),
+            )
+            for row in best
+        ]
+
+
+if __name__ == "__main__":
+    from extract import Parser
+
+    target_courses = ["AB1201", "AB1601", "AD1102", "CC0001", "SC1006", "SC2001"]
+    parser = Parser("mods", cache_path="mods/parsed.json")
+    parser.process_all_courses(target_courses + ["SC2002", "SC2203"])
+    planner = Planner(
+        parser.courses, target_num=7, conflict_cache="mods/conflicts.json"
+    )
+    replanner = Replanner(planner)
+    print(
+        f"Enumerated {replanner.ids.shape[1]} feasible timetables in "
+        f"{replanner.enumerate_seconds:.2f}s"
+    )
+    for snapshot in range(3):
+        # Stand-in for a fresh stars.html: vacancies come and go
+        for course_vacancies in parser.vacancies.values():
+            for index in course_vacancies:
+                course_vacancies[index] = hash((snapshot, index)) % 3
+        start = time.perf_counter()
+        solutions = replanner.replan(parser.vacancies)
+        print(
+            f"Snapshot {snapshot}: re-ranked in "
+            f"{(time.perf_counter() - start) * 1000:.1f}ms, best {solutions[0].score}"
+        )
@@ -0,0 +1,466 @@
+import pickle
+from dataclasses import dataclass, field, replace
+from multiprocessing.shared_memory import SharedMemory
+from typing import TYPE_CHECKING
+
+from models import DAYS, CompiledCatalog, Solution
+from pruning_grid import AliveMasks, PruningGrid, PruningList
+from search_stats import SearchStats
+from solution_heap import HeapEntry, Score, SharedScore, SolutionHeap
+
+if TYPE_CHECKING:
+    from leaf_batch import LeafBatch, LeafFeatures
+
+ALL_DAYS = (1 << DAYS) - 1
+# Nodes between reads of the shared floor
+FLOOR_REFRESH = 1024
+# Subtrees a Memo holds before it stops taking new ones
+MEMO_SIZE = 200_000
+# Fewest remaining courses worth memoizing a subtree for
+MEMO_DEPTH = 2
+
+type Placement = tuple[int, int]  # (course position, index bit)
+# (remaining courses, their alive masks, busy days, physical days) -> entry
+type Memo = dict[tuple, "MemoEntry"]
+
+
+def shift(score: Score | None, offset: Score, sign: int = 1) -> Score | None:
+    if score is None:
+        return None
+    return tuple(value + sign * delta for value, delta in zip(score, offset))
+
+
+@dataclass(frozen=True, slots=True)
+class MemoEntry:
+    """A subtree's top `limit` completions scoring above `floor`."""
+
+    limit: int
+    floor: Score | None
+    # Scores relative to the prefix's, without the prefix's ids
+    entries: tuple[HeapEntry, ...]
+
+    def covers(self, limit: int, floor: Score | None) -> bool:
+        """Whether these are all the completions a search with these needs."""
+        if limit > self.limit:
+            return False
+        return self.floor is None or (floor is not None and floor >= self.floor)
+
+
+@dataclass(frozen=True, slots=True)
+class SearchProblem:
+    """
+    Immutable, Pydantic-free view of a planning problem: the only thing a
+    worker process needs in order to search a combination of courses.
+    """
+
+    catalog: CompiledCatalog
+    # Alive masks before any course is assigned
+    alive: tuple[int, ...]
+    # Per course, per index, per other course: mask of clashing indexes
+    conflicts: tuple[tuple[tuple[int, ...], ...], ...]
+    # Per course: index bits in the order solve tries them
+    value_order: tuple[tuple[int, ...], ...]
+    # Needed to search with batch_leaves, see with_leaf_features
+    leaf_features: "LeafFeatures | None" = None
+
+    @classmethod
+    def compile(
+        cls,
+        pruning_grid: PruningGrid,
+        pruned_indexes: PruningList,
+        held: tuple[Placement, ...] = (),
+    ) -> "SearchProblem":
+        """`held` are indexes already taken, which never count as shortfall."""
+        catalog = pruning_grid.catalog
+        problem = cls(
+            catalog=catalog,
+            alive=tuple(pruning_grid.masks_from_pruning(pruned_indexes)),
+            conflicts=pruning_grid.conflicts,
+            value_order=cls.order_values(catalog),
+        )
+        return problem.with_vacant(held) if held else problem
+
+    @staticmethod
+    def order_values(catalog: CompiledCatalog) -> tuple[tuple[int, ...], ...]:
+        """
+        Each course's indexes, best scoring on their own first: vacant, then
+        fewest busy days, then fewest morning lessons. Strong timetables are
+        found early, which raises the threshold sooner and gives a time
+        limited search better answers.
+        """
+        return tuple(
+            tuple(
+                sorted(
+                    range(len(indexes)),
+                    key=lambda bit: SolutionHeap.make_score(
+                        not indexes[bit].vacant,
+                        indexes[bit].busy_days,
+                        indexes[bit].morning_lessons,
+                        0,
+                    ),
+                    reverse=True,
+                )
+            )
+            for indexes in catalog.indexes
+        )
+
+    def with_vacant(self, placements: tuple[Placement, ...]) -> "SearchProblem":
+        """Copy in which the indexes at `placements` never count as shortfall."""
+        vacant = [[index.vacant for index in course] for course in self.catalog.indexes]
+        for pos, bit in placements:
+            vacant[pos][bit] = True
+        return self.with_vacancies(vacant)
+
+    def with_vacancies(self, vacant: list[list[bool]]) -> "SearchProblem":
+        """Copy with the vacant flag of every index, by position and bit, replaced."""
+        catalog = replace(
+            self.catalog,
+            indexes=tuple(
+                tuple(
+                    index if index.vacant == flag else replace(index, vacant=flag)
+                    for index, flag in zip(course, flags)
+                )
+                for course, flags in zip(self.catalog.indexes, vacant)
+            ),
+        )
+        problem = replace(self, catalog=catalog, value_order=self.order_values(catalog))
+        return problem.with_leaf_features() if self.leaf_features else problem
+
+    def with_leaf_features(self) -> "SearchProblem":
+        """Copy that can score leaves in NumPy batches."""
+        from leaf_batch import LeafFeatures
+
+        return replace(self, leaf_features=LeafFeatures.compile(self.catalog))
+
+    @property
+    def codes(self) -> tuple[str, ...]:
+        return self.catalog.codes
+
+    @property
+    def index_keys(self) -> tuple[tuple[str, ...], ...]:
+        return self.catalog.index_keys
+
+    @property
+    def aus(self) -> tuple[int, ...]:
+        return self.catalog.aus
+
+    def to_shared_memory(self) -> SharedMemory:
+        """Caller owns the returned block and must close and unlink it."""
+        payload = pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+        shm = SharedMemory(create=True, size=len(payload))
+        shm.buf[: len(payload)] = payload
+        return shm
+
+    @classmethod
+    def from_shared_memory(cls, name: str) -> "SearchProblem":
+        shm = SharedMemory(name=name)
+        try:
+            return pickle.loads(shm.buf)
+        finally:
+            shm.close()
+
+    def positions(self, courses: set[str]) -> set[int]:
+        return {self.codes.index(code) for code in courses}
+
+    def mrv(self, remaining: set[int], alive: AliveMasks) -> int:
+        mrv, min_remaining = -1, float("inf")
+        for pos in remaining:
+            num_alive = alive[pos].bit_count()
+            if num_alive < min_remaining:
+                min_remaining = num_alive
+                mrv = pos
+        return mrv
+
+    def ids(self, placements: list[Placement]) -> tuple[int, ...]:
+        first_ids = self.catalog.first_ids
+        return tuple(first_ids[pos] + bit for pos, bit in placements)
+
+    def materialize(self, entries: list[HeapEntry]) -> list[Solution]:
+        return [self.catalog.solution(score, ids) for score, ids in entries]
+
+    def solve(
+        self,
+        search: "Search",
+        remaining: set[int],
+        placements: list[Placement],
+        alive: AliveMasks,
+        busy_days: int = 0,
+        morning_lessons: int = 0,
+        shortfall: int = 0,
+        physical_days: int = 0,
+    ):
+        stats, solution_heap = search.stats, search.solution_heap
+        stats.nodes += 1
+        stats.depth_nodes[len(placements)] += 1
+        if search.shared_floor is not None and not stats.nodes % FLOOR_REFRESH:
+            search.refresh_floor()
+        # Score of the partial assignment. Adding indexes only adds shortfall,
+        # busy days and morning lessons, and busy days only shorten streaks,
+        # so this also bounds every completion of it.
+        score = SolutionHeap.make_score(
+            shortfall, busy_days, morning_lessons, search.combo_aus
+        )
+        if not remaining:
+            stats.leaves += 1
+            stats.duplicates_avoided += DAYS - physical_days.bit_count() - 1
+            if solution_heap.accepts(score):
+                solution_heap.add_entry((score, self.ids(placements)))
+            return
+        if not solution_heap.accepts(score):
+            stats.pruned += 1
+            return
+        if search.leaf_batch is not None and len(remaining) == 1:
+            (pos,) = remaining
+            search.leaf_batch.add(
+                self.ids(placements),
+                pos,
+                alive[pos],
+                busy_days,
+                morning_lessons,
+                shortfall,
+                physical_days,
+            )
+            if search.leaf_batch.full:
+                search.leaf_batch.flush(search)
+            return
+        if search.memo is not None and len(remaining) >= MEMO_DEPTH:
+            self.solve_memoized(
+                search,
+                remaining,
+                placements,
+                alive,
+                busy_days,
+                morning_lessons,
+                shortfall,
+                physical_days,
+            )
+            return
+        self.expand(
+            search,
+            remaining,
+            placements,
+            alive,
+            busy_days,
+            morning_lessons,
+            shortfall,
+            physical_days,
+        )
+
+    def expand(
+        self,
+        search: "Search",
+        remaining: set[int],
+        placements: list[Placement],
+        alive: AliveMasks,
+        busy_days: int,
+        morning_lessons: int,
+        shortfall: int,
+        physical_days: int,
+    ):
+        """Tries each alive index of the most constrained remaining course."""
+        stats = search.stats
+        stats.depth_expanded[len(placements)] += 1
+        pos = self.mrv(remaining, alive)
+        conflicts = self.conflicts[pos]
+        indexes = self.catalog.indexes[pos]
+        valid = alive[pos]
+        remaining.remove(pos)
+        for bit in self.value_order[pos]:
+            if not valid >> bit & 1:
+                continue
+            index = indexes[bit]
+            if physical_days | index.physical_days == ALL_DAYS:
+                stats.no_free_day += 1
+                continue
+            if stats.nodes > search.node_budget:
+                # Over budget: hand the unexplored siblings back as subtasks
+                search.deferred.append((*placements, (pos, bit)))
+                stats.deferred += 1
+                continue
+            placements.append((pos, bit))
+            self.solve(
+                search,
+                remaining,
+                placements,
+                [mask & ~clash for mask, clash in zip(alive, conflicts[bit])],
+                busy_days | index.busy_days,
+                morning_lessons + index.morning_lessons,
+                shortfall + (not index.vacant),
+                physical_days | index.physical_days,
+            )
+            placements.pop()
+        remaining.add(pos)
+
+    def solve_memoized(
+        self,
+        search: "Search",
+        remaining: set[int],
+        placements: list[Placement],
+        alive: AliveMasks,
+        busy_days: int,
+        morning_lessons: int,
+        shortfall: int,
+        physical_days: int,
+    ):
+        """
+        expand, reusing the completions found the last time the same courses
+        remained with the same alive indexes, busy days and physical days.
+        Shortfall, morning lessons and AUs only shift every completion's score
+        by the same amount, so completions are cached relative to the prefix.
+        """
+        assert search.memo is not None
+        stats, solution_heap = search.stats, search.solution_heap
+        courses = tuple(sorted(remaining))
+        key = (
+            courses,
+            tuple(alive[pos] for pos in courses),
+            busy_days,
+            physical_days,
+        )
+        offset = (-shortfall, 0, 0, -morning_lessons, search.combo_aus)
+        threshold = solution_heap.threshold()
+        entry = search.memo.get(key)
+        if entry is not None and entry.covers(
+            solution_heap.limit, shift(threshold, offset, -1)
+        ):
+            stats.memo_hits += 1
+            prefix = self.ids(placements)
+            for score, ids in entry.entries:
+                score = shift(score, offset)
+                if not solution_heap.accepts(score):
+                    break
+                solution_heap.add_entry((score, prefix + ids))
+            return
+        stats.memo_misses += 1
+        # Search the subtree into a heap of its own, so that what it holds
+        # afterwards is exactly this subtree's top `limit` above `threshold`
+        sub_heap = SolutionHeap(limit=solution_heap.limit, floor=threshold)
+        deferred = stats.deferred
+        search.solution_heap = sub_heap
+        try:
+            self.expand(
+                search,
+                remaining,
+                placements,
+                alive,
+                busy_days,
+                morning_lessons,
+                shortfall,
+                physical_days,
+            )
+            if search.leaf_batch is not None:
+                search.leaf_batch.flush(search)
+        finally:
+            search.solution_heap = solution_heap
+        entries = sub_heap.get_sorted_results()
+        for score, ids in entries:
+            if solution_heap.accepts(score):
+                solution_heap.add_entry((score, ids))
+        # A subtree with deferred branches wasn't fully searched here
+        if stats.deferred == deferred and len(search.memo) < MEMO_SIZE:
+            search.memo[key] = MemoEntry(
+                sub_heap.limit,
+                shift(sub_heap.floor, offset, -1),
+                tuple(
+                    (shift(score, offset, -1), ids[len(placements) :])
+                    for score, ids in entries
+                ),
+            )
+
+    def descend(
+        self, prefix: tuple[Placement, ...]
+    ) -> tuple[AliveMasks, int, int, int, int]:
+        """solve's state after placing `prefix`, in the order of its arguments."""
+        alive = list(self.alive)
+        busy_days, morning_lessons, shortfall, physical_days = 0, 0, 0, 0
+        for pos, bit in prefix:
+            index = self.catalog.indexes[pos][bit]
+            alive = [
+                mask & ~clash for mask, clash in zip(alive, self.conflicts[pos][bit])
+            ]
+            busy_days |= index.busy_days
+            morning_lessons += index.morning_lessons
+            shortfall += not index.vacant
+            physical_days |= index.physical_days
+        return alive, busy_days, morning_lessons, shortfall, physical_days
+
+    def search(
+        self,
+        combo: tuple[int, ...],
+        limit: int,
+        prefix: tuple[Placement, ...] = (),
+        node_budget: float = float("inf"),
+        floor: Score | None = None,
+        shared_floor: SharedScore | None = None,
+        memo: Memo | None = None,
+        batch_leaves: bool = False,
+    ) -> "Search":
+        """
+        Top `limit` solutions scoring above `floor` and taking exactly the
+        courses at positions `combo`, with the placements in `prefix` fixed.
+        Once `node_budget` nodes have been visited, the branches not yet
+        explored are left in `deferred`. `shared_floor`, if given, is polled
+        to raise `floor` as better solutions are found elsewhere. `memo`, if
+        given, is read and filled so later searches can skip repeated subtrees.
+        With `batch_leaves`, leaves are buffered and scored together in NumPy.
+        """
+        search = Search(
+            SolutionHeap(limit=limit, floor=floor),
+            sum(self.aus[pos] for pos in combo),
+            node_budget,
+            shared_floor,
+            memo,
+        )
+        search.stats.start_depths(len(combo))
+        if batch_leaves:
+            from leaf_batch import LeafBatch
+
+            assert self.leaf_features is not None, "use with_leaf_features first"
+            search.leaf_batch = LeafBatch(self.leaf_features)
+        if shared_floor is not None:
+            search.refresh_floor()
+        alive, *components = self.descend(prefix)
+        # One pass that requires at least one day without physical lessons,
+        # rather than one pass per day with that day pruned, which found and
+        # scored every timetable once per free day.
+        self.solve(
+            search,
+            set(combo) - {pos for pos, _ in prefix},
+            list(prefix),
+            alive,
+            *components,
+        )
+        if search.leaf_batch is not None:
+            search.leaf_batch.flush(search)
+        return search
+
+
+@dataclass
+class Search:
+    """State shared by every node of one SearchProblem.search call."""
+
+    solution_heap: SolutionHeap
+    combo_aus: int
+    node_budget: float
+    shared_floor: SharedScore | None = None
+    memo: Memo | None = None
+    leaf_batch: "LeafBatch | None" = None
+    stats: SearchStats = field(default_factory=SearchStats)
+    deferred: list[tuple[Placement, ...]] = field(default_factory=list)
+
+    def refresh_floor(self):
+        assert self.shared_floor is not None
+        floor = self.shared_floor.get()
+        if floor is not None:
+            self.solution_heap.raise_floor(floor)
+
+    def results(self) -> list[HeapEntry]:
+        """The heap's entries that still beat the latest floor."""
+        if self.shared_floor is not None:
+            self.refresh_floor()
+        floor = self.solution_heap.floor
+        return [
+            entry
+            for entry in self.solution_heap.get_sorted_results()
+            if floor is None or entry[0] > floor
+        ]
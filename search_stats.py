@@ -0,0 +1,169 @@
+import cProfile
+import os
+import pstats
+from collections import defaultdict
+from dataclasses import dataclass, field, fields
+
+# Where a profiled function's own time is counted in a report's phases
+PHASES = {
+    "make_score": "scoring",
+    "flush": "scoring",
+    "threshold": "heap",
+    "accepts": "heap",
+    "add_entry": "heap",
+    "raise_floor": "heap",
+    "refresh_floor": "heap",
+    "expand": "clash masks and branching",
+    "mrv": "ordering",
+    "solve": "node bookkeeping",
+    "solve_memoized": "memo",
+}
+
+
+@dataclass
+class SearchStats:
+    nodes: int = 0
+    leaves: int = 0
+    pruned: int = 0  # branches cut because their bound can't beat the heap
+    no_free_day: int = 0  # indexes skipped because they'd leave no free day
+    # Extra times a per-day search would have re-found the leaves found here
+    duplicates_avoided: int = 0
+    deferred: int = 0  # branches handed back as subtasks when over budget
+    memo_hits: int = 0  # subtrees answered from the memo instead of searched
+    memo_misses: int = 0
+    # Per number of courses placed: nodes visited, and nodes that branched
+    depth_nodes: list[int] = field(default_factory=list)
+    depth_expanded: list[int] = field(default_factory=list)
+    # Per function, when profiled: [calls, own seconds, cumulative seconds]
+    profile: dict[str, list[float]] = field(default_factory=dict)
+
+    def merge(self, other: "SearchStats"):
+        for f in fields(self):
+            mine, theirs = getattr(self, f.name), getattr(other, f.name)
+            if isinstance(mine, list):
+                mine.extend([0] * (len(theirs) - len(mine)))
+                for depth, count in enumerate(theirs):
+                    mine[depth] += count
+            elif isinstance(mine, dict):
+                for function, totals in theirs.items():
+                    mine[function] = [
+                        a + b for a, b in zip(mine.get(function, [0, 0, 0]), totals)
+                    ]
+            else:
+                setattr(self, f.name, mine + theirs)
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{f.name}={getattr(self, f.name)}"
+            for f in fields(self)
+            if isinstance(getattr(self, f.name), int)
+        )
+
+    def start_depths(self, depth: int):
+        """Sizes the per-depth counters for searches placing `depth` courses."""
+        self.depth_nodes = [0] * (depth + 1)
+        self.depth_expanded = [0] * (depth + 1)
+
+    def add_profile(self, profiler: cProfile.Profile):
+        for (path, line, name), (_, calls, own, cumulative, _) in pstats.Stats(
+            profiler
+        ).stats.items():  # type: ignore[attr-defined]
+            function = f"{os.path.basename(path)}:{line}({name})"
+            totals = self.profile.get(function, [0, 0, 0])
+            self.profile[function] = [
+                a + b for a, b in zip(totals, (calls, own, cumulative))
+            ]
+
+    def depths(self) -> list[dict]:
+        return [
+            {
+                "depth": depth,
+                "nodes": nodes,
+                "expanded": expanded,
+                # Children per node that branched
+                "branching": (
+                    round(self.depth_nodes[depth + 1] / expanded, 2)
+                    if expanded and depth + 1 < len(self.depth_nodes)
+                    else None
+                ),
+            }
+            for depth, (nodes, expanded) in enumerate(
+                zip(self.depth_nodes, self.depth_expanded)
+            )
+        ]
+
+    def phases(self) -> dict[str, float]:
+        """Profiled own time, in seconds, grouped by what the search was doing."""
+        phases: dict[str, float] = defaultdict(float)
+        for function, (_, own, _) in self.profile.items():
+            name = function[function.index("(") + 1 : -1]
+            phases[PHASES.get(name, "other")] += own
+        return {phase: round(seconds, 4) for phase, seconds in phases.items()}
+
+
+@dataclass
+class TaskTiming:
+    combo: tuple[str, ...]
+    prefix: tuple[tuple[str, str], ...]  # (course_code, index) fixed before searching
+    seconds: float
+    nodes: int
+
+
+def timing_report(timings: list[TaskTiming], wall: float, workers: int) -> str:
+    """How evenly the tasks kept `workers` processes busy over `wall` seconds."""
+    if not timings:
+        return "No tasks were run."
+    busy = sum(timing.seconds for timing in timings)
+    slowest = max(timings, key=lambda timing: timing.seconds)
+    return (
+        f"{len(timings)} tasks, {busy:.2f}s of work in {wall:.2f}s on {workers} "
+        f"workers ({busy / (wall * workers):.0%} utilisation); slowest task "
+        f"{slowest.seconds:.2f}s ({slowest.nodes} nodes) for {slowest.combo} "
+        f"with {slowest.prefix}"
+    )
+
+
+def planner_report(
+    stats: SearchStats, timings: list[TaskTiming], wall: float, workers: int
+) -> dict:
+    """Everything run_planner measured, as a JSON-serialisable dict."""
+    combos: dict[tuple[str, ...], dict] = {}
+    for timing in timings:
+        combo = combos.setdefault(
+            timing.combo,
+            {"courses": list(timing.combo), "seconds": 0.0, "tasks": 0, "nodes": 0},
+        )
+        combo["seconds"] += timing.seconds
+        combo["tasks"] += 1
+        combo["nodes"] += timing.nodes
+    busy = sum(timing.seconds for timing in timings)
+    report = {
+        "wall_seconds": round(wall, 4),
+        "workers": workers,
+        "tasks": len(timings),
+        "busy_seconds": round(busy, 4),
+        "utilisation": round(busy / (wall * workers), 4) if wall else None,
+        "stats": {
+            f.name: getattr(stats, f.name)
+            for f in fields(stats)
+            if isinstance(getattr(stats, f.name), int)
+        },
+        "depths": stats.depths(),
+        "combos": sorted(
+            combos.values(), key=lambda combo: combo["seconds"], reverse=True
+        ),
+    }
+    if stats.profile:
+        report["phases"] = stats.phases()
+        report["functions"] = [
+            {
+                "function": function,
+                "calls": calls,
+                "own_seconds": round(own, 4),
+                "cumulative_seconds": round(cumulative, 4),
+            }
+            for function, (calls, own, cumulative) in sorted(
+                stats.profile.items(), key=lambda item: item[1][1], reverse=True
+            )[:25]
+        ]
+    return report
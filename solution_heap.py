@@ -1,66 +1,137 @@
 import heapq
+import multiprocessing
 from dataclasses import dataclass, field
 
-from models import DAYS, Course, Solution
+from models import DAYS
 
 type Score = tuple[int, ...]  # (free_days, max_streak, -morning_lessons)
-type Assignment = tuple[tuple[str, str], ...]  # ((course_code, index), ...)
-type HeapEntry = tuple[Score, Assignment]
+# A solution as its score and the CompiledIndex ids it takes, ordered by
+# score; CompiledCatalog.solution turns one into a Solution
+type HeapEntry = tuple[Score, tuple[int, ...]]
+
+
+def max_streak(busy_days: int) -> int:
+    """Longest run of free days in a (DAYS + 1)-bit busy mask, wrapping around."""
+    cur_streak, longest = 0, 0
+    for day in range(2 * (DAYS + 1)):
+        if busy_days >> (day % (DAYS + 1)) & 1:
+            cur_streak = 0
+        else:
+            cur_streak += 1
+            longest = max(longest, cur_streak)
+    return longest
+
+
+STREAKS = tuple(max_streak(busy_days) for busy_days in range(1 << (DAYS + 1)))
 
 
 @dataclass
 class SolutionHeap:
-    all_courses: dict[str, Course]
-    assigned_indexes: dict[str, str]
     limit: int = 50
-    heap: list[Solution] = field(default_factory=list)
-
-    def get_solution(self, assignment: dict[str, str]) -> Solution:
-        morning_lessons, busy_days = 0, [False] * (DAYS + 1)
-        mandatory = {"Tut", "Sem", "Lab"}
-        vacancy_shortfall = set()
-        for code, idx in assignment.items():
-            if (
-                code not in self.assigned_indexes
-                and not self.all_courses[code].get_index(idx).vacant
-            ):
-                vacancy_shortfall.add((code, idx))
-            for lesson in self.all_courses[code].get_index(idx).lessons:
-                if any(m in lesson.lesson_type for m in mandatory):
-                    busy_days[lesson.day - 1] = True
-                    if lesson.start < 9:
-                        morning_lessons += 2
-                    elif lesson.start < 10:
-                        morning_lessons += 1
-        cur_streak, max_streak = 0, 0
-        for day in busy_days * 2:
-            if day:
-                cur_streak = 0
-            else:
-                cur_streak += 1
-                max_streak = max(max_streak, cur_streak)
-        aus = sum(self.all_courses[code].aus for code in assignment)
-        score = (
-            -len(vacancy_shortfall),
-            DAYS + 1 - sum(busy_days),
-            max_streak,
+    heap: list[HeapEntry] = field(default_factory=list)
+    # Solutions scoring at or below this are rejected even while not full
+    floor: Score | None = None
+
+    @staticmethod
+    def make_score(
+        shortfall: int, busy_days: int, morning_lessons: int, aus: int
+    ) -> Score:
+        return (
+            -shortfall,
+            DAYS + 1 - busy_days.bit_count(),
+            STREAKS[busy_days],
             -morning_lessons,
             aus,
         )
-        return Solution(
-            assignment=assignment, vacancy_shortfall=vacancy_shortfall, score=score
-        )
 
-    def add_assignment(self, assignment: dict[str, str]):
-        solution = self.get_solution(assignment)
-        self.add_solution(solution)
+    def threshold(self) -> Score | None:
+        """Score a new solution must beat to enter the heap."""
+        if len(self.heap) < self.limit:
+            return self.floor
+        if self.floor is not None and self.floor > self.heap[0][0]:
+            return self.floor
+        return self.heap[0][0]
+
+    def raise_floor(self, floor: Score):
+        if self.floor is None or floor > self.floor:
+            self.floor = floor
 
-    def add_solution(self, solution: Solution):
+    def accepts(self, score: Score) -> bool:
+        """Whether a solution with this score would enter the heap."""
+        threshold = self.threshold()
+        return threshold is None or score > threshold
+
+    def add_entry(self, entry: HeapEntry) -> bool:
+        """Returns whether the entry made it into the heap."""
         if len(self.heap) < self.limit:
-            heapq.heappush(self.heap, solution)
-        else:
-            if solution > self.heap[0]:
-                heapq.heapreplace(self.heap, solution)
+            heapq.heappush(self.heap, entry)
+            return True
+        if entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
+            return True
+        return False
 
-    def get_sorted_results(self) -> list[Solution]:
+    def get_sorted_results(self) -> list[HeapEntry]:
         return sorted(self.heap, reverse=True)
+
+
+def combo_limit(num_combos: int) -> int:
+    """How many solutions each of `num_combos` combinations may bring."""
+    return max(10, 50 // num_combos) if num_combos else 10
+
+
+@dataclass
+class ComboHeaps:
+    """
+    The top `limit` entries of each combination of courses, however many
+    tasks its search was split into, and the best of them all in `heap`.
+    """
+
+    limit: int
+    heap: SolutionHeap = field(default_factory=SolutionHeap)
+    combos: dict[tuple[int, ...], SolutionHeap] = field(default_factory=dict)
+
+    def add_entries(self, combo: tuple[int, ...], entries: list[HeapEntry]) -> bool:
+        """Adds one task's entries; returns whether `heap` changed."""
+        combo_heap = self.combos.setdefault(combo, SolutionHeap(limit=self.limit))
+        added, dropped = False, False
+        for entry in entries:
+            full = len(combo_heap.heap) >= combo_heap.limit
+            if combo_heap.add_entry(entry):
+                dropped |= full
+                if not dropped:
+                    added |= self.heap.add_entry(entry)
+        if not dropped:
+            return added
+        # An entry the combination no longer counts may be in `heap`
+        before = sorted(self.heap.heap)
+        self.heap.heap = heapq.nlargest(
+            self.heap.limit,
+            (entry for heap in self.combos.values() for entry in heap.heap),
+        )
+        heapq.heapify(self.heap.heap)
+        return sorted(self.heap.heap) != before
+
+
+class SharedScore:
+    """
+    A Score readable from every worker process that only ever increases,
+    used to broadcast the parent heap's threshold to the workers.
+    """
+
+    def __init__(self, width: int = 5):
+        # values[0] is 1 once a score has been set, the score follows it
+        self.values = multiprocessing.Array("q", width + 1)
+
+    def get(self) -> Score | None:
+        with self.values.get_lock():
+            if not self.values[0]:
+                return None
+            return tuple(self.values[1:])
+
+    def raise_to(self, score: Score):
+        with self.values.get_lock():
+            if self.values[0] and score <= tuple(self.values[1:]):
+                return
+            self.values[0] = 1
+            self.values[1:] = list(score)
@@ -1,6 +1,10 @@
 import os
 import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from queue import Empty, Queue
 from typing import Iterable
 
 from dotenv import load_dotenv
@@ -13,12 +17,65 @@ from webdriver_manager.chrome import ChromeDriverManager
 
 load_dotenv()
 
+BASE_URL = "https://wish.wis.ntu.edu.sg/pls/webexe/ldap_login.login?w_url=https://wish.wis.ntu.edu.sg/pls/webexe/aus_stars_planner.main"
+
+
+@dataclass
+class Pacer:
+    """
+    Spaces out requests to STARS across every session sharing it. The gap
+    doubles whenever a request fails and shrinks back while they succeed.
+    """
+
+    min_gap: float = 0.2
+    max_gap: float = 8.0
+    gap: float = 0.5
+    jitter: float = 0.25  # up to this fraction of the gap is added at random
+    next_time: float = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def pace(self):
+        """Waits for this session's turn to send a request."""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.gap * (1 + random.uniform(0, self.jitter))
+        time.sleep(start - now)
+
+    def succeeded(self):
+        with self.lock:
+            self.gap = max(self.min_gap, self.gap * 0.9)
+
+    def failed(self):
+        with self.lock:
+            self.gap = min(self.max_gap, self.gap * 2)
+
+
+def stale_courses(
+    folder_path: str, course_codes: Iterable[str], max_age: float
+) -> list[str]:
+    """Courses whose saved page is missing or older than `max_age` seconds."""
+    stale = []
+    for code in course_codes:
+        path = f"{folder_path}/{code}.html"
+        if not os.path.exists(path) or time.time() - os.path.getmtime(path) > max_age:
+            stale.append(code)
+    return stale
+
 
 class StarsDownloader:
-    def __init__(self, headless=False):
+    def __init__(
+        self,
+        headless=False,
+        base_url: str = BASE_URL,
+        folder_path: str = "mods",
+        pacer: Pacer | None = None,
+    ):
         self.username = str(os.getenv("stars_id"))
         self.password = str(os.getenv("stars_password"))
-        self.base_url = "https://wish.wis.ntu.edu.sg/pls/webexe/ldap_login.login?w_url=https://wish.wis.ntu.edu.sg/pls/webexe/aus_stars_planner.main"
+        self.base_url = base_url
+        self.folder_path = folder_path
+        self.pacer = pacer or Pacer()
 
         options = webdriver.ChromeOptions()
         if headless:
@@ -29,8 +86,19 @@ class StarsDownloader:
         )
         self.wait = WebDriverWait(self.driver, 12)
 
-    def _random_delay(self, min_s=0.5, max_s=1.5):
-        time.sleep(random.uniform(min_s, max_s))
+    def wait_ready(self):
+        """Waits for the current page to finish loading."""
+        self.wait.until(
+            lambda driver: driver.execute_script("return document.readyState")
+            == "complete"
+        )
+
+    def save(self, file_name: str):
+        """Writes the page source whole, so readers never see half a page."""
+        path = f"{self.folder_path}/{file_name}"
+        with open(f"{path}.part", "w", encoding="utf-8") as f:
+            f.write(self.driver.page_source)
+        os.replace(f"{path}.part", path)
 
     def login(self):
         """Handles the multi-step LDAP login process."""
@@ -42,7 +110,7 @@ class StarsDownloader:
                 EC.presence_of_element_located((By.NAME, "UID"))
             )
             uid_field.send_keys(self.username)
-            self._random_delay()
+            self.pacer.pace()
             self.driver.find_element(By.XPATH, "//input[@value='OK']").click()
 
             # 2. Enter Password
@@ -50,11 +118,12 @@ class StarsDownloader:
                 EC.visibility_of_element_located((By.NAME, "PW"))
             )
             pw_field.send_keys(self.password)
-            self._random_delay()
+            self.pacer.pace()
             self.driver.find_element(By.XPATH, "//input[@value='OK']").click()
 
             # 3. Verify Landing
             self.wait.until(EC.url_contains("AUS_STARS_PLANNER.planner"))
+            self.planner_url = self.driver.current_url
             print("Successfully logged into STARS.")
             return True
         except Exception as e:
@@ -63,17 +132,15 @@ class StarsDownloader:
 
     def is_module_in_planner(self, course_code):
         """Checks if a specific course code is currently visible in the planner table."""
-        try:
-            # Use a shorter wait for checking existence to keep the script fast
-            short_wait = WebDriverWait(self.driver, 3)
-            module_xpath = f"//span[@title='Click link for more details']//font[text()='{course_code}']"
-
-            short_wait.until(EC.presence_of_element_located((By.XPATH, module_xpath)))
+        # Once the page has loaded the row is either there or not, no need to
+        # keep polling for it
+        self.wait_ready()
+        module_xpath = f"//span[@title='Click link for more details']//font[text()='{course_code}']"
+        if self.driver.find_elements(By.XPATH, module_xpath):
             print(f"Module {course_code} found in planner.")
             return True
-        except Exception:
-            print(f"Module {course_code} is NOT present in the planner.")
-            return False
+        print(f"Module {course_code} is NOT present in the planner.")
+        return False
 
     def add_module(self, course_code: str):
         print(f"Adding {course_code} to planner...")
@@ -85,12 +152,16 @@ class StarsDownloader:
         self.wait.until(EC.alert_is_present())
         alert = self.driver.switch_to.alert
         alert.send_keys(course_code)
+        self.pacer.pace()
         alert.accept()
-        self._random_delay(2.0, 3.0)  # Allow time for DOM refresh
+        # Accepting submits the planner form: wait for the reloaded page
+        self.wait.until(EC.staleness_of(add_btn))
+        self.wait_ready()
 
     def download_module_html(self, course_code: str):
         module_xpath = f"//span[@title='Click link for more details']//font[text()='{course_code}']"
         module_link = self.driver.find_element(By.XPATH, module_xpath)
+        self.pacer.pace()
         module_link.click()
         print(f"Proceeding to download HTML for {course_code}.")
         original_window = self.driver.current_window_handle
@@ -106,29 +177,36 @@ class StarsDownloader:
         self.wait.until(EC.url_contains("AUS_STARS_PLANNER.course_info"))
         self.wait.until(EC.presence_of_element_located((By.TAG_NAME, "table")))
 
-        with open(f"mods/{course_code}.html", "w", encoding="utf-8") as f:
-            f.write(self.driver.page_source)
+        self.save(f"{course_code}.html")
         print(f"Page source saved to {course_code}.html")
         self.driver.close()
         self.driver.switch_to.window(original_window)
 
     def download_stars_page(self):
-        with open(f"mods/stars.html", "w", encoding="utf-8") as f:
-            f.write(self.driver.page_source)
+        self.save("stars.html")
         print(f"Page source saved to stars.html")
 
+    def reload_planner(self):
+        """Back to a freshly loaded planner, with courses other sessions added."""
+        self.pacer.pace()
+        self.driver.get(self.planner_url)
+        self.wait_ready()
+
+    def scrape_module(self, code: str) -> bool:
+        """Adds the course if needed and saves its page; False if it can't be added."""
+        if not self.is_module_in_planner(code):
+            self.add_module(code)
+            if not self.is_module_in_planner(code):
+                print(f"Skipping download: {code} could not be added to the planner.")
+                return False
+        self.download_module_html(code)
+        return True
+
     def scrape_modules(self, course_codes: Iterable[str]):
         """Navigates to course info and saves source, with pre-check logic."""
         for code in course_codes:
             try:
-                if not self.is_module_in_planner(code):
-                    self.add_module(code)
-                if self.is_module_in_planner(code):
-                    self.download_module_html(code)
-                else:
-                    print(
-                        f"Skipping download: {code} could not be added to the planner."
-                    )
+                self.scrape_module(code)
             except Exception as e:
                 print(f"Error processing {code}: {e}")
         self.download_stars_page()
@@ -137,23 +215,107 @@ class StarsDownloader:
         self.driver.quit()
 
 
+@dataclass
+class DownloaderPool:
+    """
+    Several logged-in StarsDownloader sessions sharing one Pacer, refreshing
+    only the course pages that are missing or older than `max_age` seconds.
+    """
+
+    sessions: int = 3
+    headless: bool = True
+    base_url: str = BASE_URL
+    folder_path: str = "mods"
+    max_age: float = 3600
+    # Further attempts at a course after an error, each from a reloaded planner
+    retries: int = 2
+    pacer: Pacer = field(default_factory=Pacer)
+
+    def stale_courses(self, course_codes: Iterable[str]) -> list[str]:
+        return stale_courses(self.folder_path, course_codes, self.max_age)
+
+    def open_session(self) -> StarsDownloader | None:
+        downloader = StarsDownloader(
+            self.headless, self.base_url, self.folder_path, self.pacer
+        )
+        if downloader.login():
+            return downloader
+        downloader.quit()
+        return None
+
+    def work(self, downloader: StarsDownloader, queue: Queue[str]) -> list[str]:
+        """Scrapes courses off the queue until it is empty; returns the failures."""
+        failed = []
+        while True:
+            try:
+                code = queue.get_nowait()
+            except Empty:
+                return failed
+            for attempt in range(self.retries + 1):
+                try:
+                    if attempt:
+                        downloader.reload_planner()
+                    if not downloader.scrape_module(code):
+                        failed.append(code)
+                    self.pacer.succeeded()
+                    break
+                except Exception as e:
+                    print(f"Error processing {code} (attempt {attempt + 1}): {e}")
+                    self.pacer.failed()
+            else:
+                failed.append(code)
+
+    def scrape_modules(self, course_codes: Iterable[str]) -> list[str]:
+        """Refreshes the stale course pages and stars.html; returns failed courses."""
+        stale = self.stale_courses(course_codes)
+        print(f"{len(stale)} course pages to refresh with {self.sessions} sessions.")
+        queue: Queue[str] = Queue()
+        for code in stale:
+            queue.put(code)
+        sessions = max(1, min(self.sessions, len(stale)))
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            downloaders = [
+                d for d in executor.map(lambda _: self.open_session(), range(sessions))
+            ]
+            downloaders = [d for d in downloaders if d is not None]
+            if not downloaders:
+                print("No session could log in.")
+                return stale
+            try:
+                failed = [
+                    code
+                    for failures in executor.map(
+                        self.work, downloaders, [queue] * len(downloaders)
+                    )
+                    for code in failures
+                ]
+                # Vacancies for every course, including those added just now
+                downloaders[0].reload_planner()
+                downloaders[0].download_stars_page()
+            finally:
+                for downloader in downloaders:
+                    downloader.quit()
+        return failed
+
+
 # --- Execution ---
 if __name__ == "__main__":
-    downloader = StarsDownloader(headless=True)
-    if downloader.login():
-        # You can now loop through multiple modules
-        target_mods = [
-            "AD1102",
-            "AB1201",
-            "AB1601",
-            # "AB1501",
-            # "AB2008",
-            # "BC2406",
-            "SC1006",
-            "SC2001",
-            "SC2002",
-            # "SC2203",
-            "CC0001",
-        ]
-        downloader.scrape_modules(target_mods)
-    downloader.quit()
+    # Logs in several sessions and only refreshes pages older than an hour.
+    # Pass base_url=stars_standin.login_url(...) to run against saved pages.
+    pool = DownloaderPool(sessions=3, headless=True)
+    target_mods = [
+        "AD1102",
+        "AB1201",
+        "AB1601",
+        # "AB1501",
+        # "AB2008",
+        # "BC2406",
+        "SC1006",
+        "SC2001",
+        "SC2002",
+        # "SC2203",
+        "CC0001",
+    ]
+    failed = pool.scrape_modules(target_mods)
+    if failed:
+        print(f"Could not download: {', '.join(failed)}")
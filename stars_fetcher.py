@@ -0,0 +1,202 @@
+"""
+Fetches course info pages over plain HTTP with the cookies of one logged-in
+StarsDownloader, instead of clicking through each page in the browser.
+"""
+
+import contextlib
+import http.client
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import Iterable, Iterator
+from urllib.parse import urlencode, urljoin, urlsplit
+
+from stars_downloader import Pacer, StarsDownloader, stale_courses
+
+CHUNK_SIZE = 64 * 1024
+
+
+class PlannerPageParser(HTMLParser):
+    """
+    Reads what view_subject submits off a planner page: the hidden fields of
+    its first form, and the r_subj_code each course link fills in.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.forms = 0
+        self.form: dict[str, str] = {}
+        self.subject_codes: dict[str, str] = {}
+        # r_subj_code of the course link being read, until its code shows up
+        self.subject_code: str | None = None
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        attrs = dict(attrs)
+        if tag == "form":
+            self.forms += 1
+        elif tag == "input" and self.forms == 1 and attrs.get("name"):
+            self.form[attrs["name"]] = attrs.get("value") or ""
+        elif tag == "a" and "view_subject(" in (attrs.get("href") or ""):
+            self.subject_code = attrs["href"].split("'")[1]
+
+    def handle_data(self, data: str):
+        if self.subject_code is not None and data.strip():
+            self.subject_codes[data.strip()] = self.subject_code
+            self.subject_code = None
+
+
+@dataclass
+class CourseFetcher:
+    """
+    Posts the planner's course info form straight to STARS for each course,
+    `concurrency` at a time. Each worker thread keeps one connection open
+    across its requests and streams every response into `folder_path`.
+    """
+
+    course_info_url: str
+    # The hidden fields view_subject posts along with r_subj_code
+    form: dict[str, str]
+    # Course code -> the r_subj_code its planner link posts
+    subject_codes: dict[str, str]
+    # The Cookie header of the logged-in browser session
+    cookie: str
+    user_agent: str = "Mozilla/5.0"
+    folder_path: str = "mods"
+    concurrency: int = 4
+    # Further attempts at a course after an error
+    retries: int = 2
+    pacer: Pacer = field(default_factory=Pacer)
+    connections: threading.local = field(init=False, default_factory=threading.local)
+
+    @classmethod
+    def from_downloader(
+        cls, downloader: StarsDownloader, course_codes: Iterable[str], **kwargs
+    ) -> "CourseFetcher":
+        """
+        Adds any of `course_codes` missing from the logged-in downloader's
+        planner, then takes the session and form it needs from the browser.
+        """
+        for code in course_codes:
+            if not downloader.is_module_in_planner(code):
+                downloader.add_module(code)
+        driver = downloader.driver
+        page = PlannerPageParser()
+        page.feed(driver.page_source)
+        return cls(
+            course_info_url=urljoin(
+                downloader.planner_url, "AUS_STARS_PLANNER.course_info"
+            ),
+            form=page.form,
+            subject_codes=page.subject_codes,
+            cookie="; ".join(
+                f"{cookie['name']}={cookie['value']}" for cookie in driver.get_cookies()
+            ),
+            user_agent=driver.execute_script("return navigator.userAgent"),
+            folder_path=downloader.folder_path,
+            **kwargs,
+        )
+
+    def connection(self) -> http.client.HTTPConnection:
+        """This thread's connection, opened on first use."""
+        connection = getattr(self.connections, "connection", None)
+        if connection is None:
+            url = urlsplit(self.course_info_url)
+            if url.scheme == "https":
+                connection = http.client.HTTPSConnection(url.netloc, timeout=30)
+            else:
+                connection = http.client.HTTPConnection(url.netloc, timeout=30)
+            self.connections.connection = connection
+        return connection
+
+    def fetch(self, code: str):
+        """Saves the course info page of `code`, whole or not at all."""
+        body = urlencode({**self.form, "r_subj_code": self.subject_codes[code]})
+        url = urlsplit(self.course_info_url)
+        path = f"{self.folder_path}/{code}.html"
+        connection = self.connection()
+        self.pacer.pace()
+        try:
+            connection.request(
+                "POST",
+                url.path,
+                body,
+                {
+                    "Content-Type": "application/x-www-form-urlencoded",
+                    "Cookie": self.cookie,
+                    "User-Agent": self.user_agent,
+                },
+            )
+            response = connection.getresponse()
+            # Anything else, a redirect back to the login page included, is
+            # not the course's page
+            if response.status != 200:
+                response.read()
+                raise RuntimeError(f"HTTP {response.status} {response.reason}")
+            with open(f"{path}.part", "wb") as f:
+                while chunk := response.read(CHUNK_SIZE):
+                    f.write(chunk)
+            # read() just stops early if the connection drops mid-page
+            if response.length:
+                raise RuntimeError(f"Connection lost {response.length} bytes short")
+            os.replace(f"{path}.part", path)
+        except Exception:
+            # Start over on a fresh connection next time
+            connection.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(f"{path}.part")
+            raise
+
+    def fetch_one(self, code: str) -> bool:
+        if code not in self.subject_codes:
+            print(f"Skipping download: {code} is not in the planner.")
+            return False
+        for attempt in range(self.retries + 1):
+            try:
+                self.fetch(code)
+            except Exception as e:
+                print(f"Error fetching {code} (attempt {attempt + 1}): {e}")
+                self.pacer.failed()
+                continue
+            self.pacer.succeeded()
+            print(f"Page source saved to {code}.html")
+            return True
+        return False
+
+    def iter_fetch(self, course_codes: Iterable[str]) -> Iterator[tuple[str, bool]]:
+        """
+        Starts fetching every course page straight away, and yields
+        (course, saved) as each one finishes.
+        """
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        futures = {executor.submit(self.fetch_one, code): code for code in course_codes}
+        # Queued fetches still run; the threads exit once they are done
+        executor.shutdown(wait=False)
+        return ((futures[future], future.result()) for future in as_completed(futures))
+
+    def fetch_all(self, course_codes: Iterable[str]) -> list[str]:
+        """Fetches every course page; returns the courses that failed."""
+        return [code for code, saved in self.iter_fetch(course_codes) if not saved]
+
+
+if __name__ == "__main__":
+    target_mods = [
+        "AD1102",
+        "AB1201",
+        "AB1601",
+        "SC1006",
+        "SC2001",
+        "SC2002",
+        "CC0001",
+    ]
+    downloader = StarsDownloader(headless=True)
+    if downloader.login():
+        stale = stale_courses("mods", target_mods, max_age=3600)
+        fetcher = CourseFetcher.from_downloader(downloader, stale)
+        # The planner now lists every course, so its vacancies are complete
+        downloader.download_stars_page()
+        failed = fetcher.fetch_all(stale)
+        if failed:
+            print(f"Could not download: {', '.join(failed)}")
+    downloader.quit()
@@ -0,0 +1,250 @@
+"""
+A local stand-in for the STARS planner, serving the pages saved in a folder
+like mods/, so StarsDownloader can be run end to end without touching STARS.
+"""
+
+import argparse
+import html
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from extract import Parser
+
+LOGIN_PATH = "/pls/webexe/ldap_login.login"
+PLANNER_PATH = "/pls/webexe/AUS_STARS_PLANNER.planner"
+COURSE_INFO_PATH = "/pls/webexe/AUS_STARS_PLANNER.course_info"
+
+LOGIN_PAGE = """<html><head><title>Login</title></head><body>
+<form action="ldap_login.login" method="post">
+{fields}
+<input type="submit" value="OK">
+</form></body></html>"""
+
+PLANNER_PAGE = """<html><head><title>Planner</title><script>
+function view_subject(form, subj) {{
+    form.r_subj_code.value = subj;
+    form.target = "_blank";
+    form.submit();
+}}
+function passvalue_add(f) {{
+    var subj = prompt("Enter Course code ", "");
+    if (subj !== null) {{
+        f.r_subj.value = subj;
+        f.boption.value = "Update";
+        f.target = "_self";
+        f.submit();
+    }}
+}}
+</script></head><body>
+<form action="AUS_STARS_PLANNER.course_info" method="post" target="_blank">
+<input type="hidden" name="r_subj_code" value="">
+</form>
+<form action="AUS_STARS_PLANNER.planner" method="post">
+<input type="hidden" name="boption" value="">
+<input type="hidden" name="r_subj" value="">
+<table><tbody>
+<tr><td><a href="javascript:passvalue_add(document.forms[1]);"><span title="Add Course Code">[+]</span></a></td></tr>
+{rows}
+</tbody></table></form></body></html>"""
+
+PLANNER_ROW = """<tr><td align="left">
+<a href="javascript:view_subject(document.forms[0],'{code}');"><span title="Click link for more details"><font size="-1">{code}</font></span></a>
+</td><td align="center">
+<select name="index_nmbr"><option value="null">-Select one-</option>{options}</select>
+</td></tr>"""
+
+BUSY_PAGE = "<html><body>The system is busy, please try again later.</body></html>"
+
+
+@dataclass
+class StandIn:
+    """
+    Serves the login pages, a planner holding the courses of the saved
+    stars.html plus any added since, and the saved course pages. Every
+    session shares one planner, as logins to the same account do.
+    """
+
+    folder_path: str = "mods"
+    # Seconds every response is held back, like a loaded server
+    latency: float = 0.0
+    # Requests per second above which the server answers 503, None for no limit
+    max_rate: float | None = None
+    parser: Parser = field(init=False)
+    planner: list[str] = field(init=False)
+    sessions: set[str] = field(init=False, default_factory=set)
+    requests: int = field(init=False, default=0)
+    rejected: int = field(init=False, default=0)
+    recent: deque = field(init=False, default_factory=deque)
+    lock: threading.Lock = field(init=False, default_factory=threading.Lock)
+
+    def __post_init__(self):
+        self.parser = Parser(self.folder_path, extractor="stream")
+        self.parser.extract_vacancy_data()
+        self.planner = list(self.parser.vacancies)
+
+    def admit(self) -> bool:
+        """Counts a request; False if it goes over max_rate."""
+        with self.lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > 1:
+                self.recent.popleft()
+            if self.max_rate is not None and len(self.recent) >= self.max_rate:
+                self.rejected += 1
+                return False
+            self.recent.append(now)
+            return True
+
+    def has_page(self, code: str) -> bool:
+        try:
+            self.parser.read(f"{code}.html")
+        except OSError:
+            return False
+        return True
+
+    def in_planner(self, code: str) -> bool:
+        with self.lock:
+            return code in self.planner
+
+    def add_course(self, code: str):
+        with self.lock:
+            if code not in self.planner and self.has_page(code):
+                self.planner.append(code)
+
+    def page(self, code: str) -> bytes:
+        """The saved course page as it is on disk, like STARS sends it."""
+        with open(f"{self.folder_path}/{code}.html", "rb") as f:
+            return f.read()
+
+    def planner_row(self, code: str) -> str:
+        vacancies = self.parser.vacancies.get(code)
+        if vacancies is None:
+            # Added since stars.html was saved: list its indexes as full
+            course = self.parser.parse_course(code)
+            vacancies = {index: 0 for index in course.indexes}
+        options = "".join(
+            f'<option value="{index}">{index} / {vacancy} / 0&nbsp;</option>'
+            for index, vacancy in vacancies.items()
+        )
+        return PLANNER_ROW.format(code=html.escape(code), options=options)
+
+    def planner_page(self) -> str:
+        with self.lock:
+            codes = list(self.planner)
+        return PLANNER_PAGE.format(rows="\n".join(map(self.planner_row, codes)))
+
+    def serve(self, port: int = 0) -> ThreadingHTTPServer:
+        """Starts serving on a background thread; port 0 picks a free one."""
+        server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(self))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def login_url(server: ThreadingHTTPServer) -> str:
+    """What to pass StarsDownloader as base_url."""
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}{LOGIN_PATH}?w_url=http://{host}:{port}{PLANNER_PATH}"
+
+
+def make_handler(standin: StandIn) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        # Keeps connections open between requests, as STARS does
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def session(self) -> str | None:
+            cookie = SimpleCookie(self.headers.get("Cookie", ""))
+            session = cookie.get("session")
+            if session is not None and session.value in standin.sessions:
+                return session.value
+            return None
+
+        def form(self) -> dict[str, str]:
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode()
+            return {key: values[0] for key, values in parse_qs(body).items()}
+
+        def send(self, status: int, body: str | bytes, headers: dict | None = None):
+            body = body.encode() if isinstance(body, str) else body
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def redirect(self, location: str, headers: dict | None = None):
+            self.send(302, "", {"Location": location, **(headers or {})})
+
+        def do_GET(self):
+            self.handle_request({})
+
+        def do_POST(self):
+            self.handle_request(self.form())
+
+        def handle_request(self, form: dict[str, str]):
+            time.sleep(standin.latency)
+            if not standin.admit():
+                return self.send(503, BUSY_PAGE)
+            path = urlsplit(self.path).path
+            if path == LOGIN_PATH:
+                return self.login(form)
+            if self.session() is None:
+                return self.redirect(LOGIN_PATH)
+            if path == PLANNER_PATH:
+                if form.get("boption") == "Update" and form.get("r_subj"):
+                    standin.add_course(form["r_subj"].strip().upper())
+                return self.send(200, standin.planner_page())
+            if path == COURSE_INFO_PATH:
+                code = form.get("r_subj_code", "")
+                # stars.html lists courses with no page saved
+                if standin.in_planner(code) and standin.has_page(code):
+                    return self.send(200, standin.page(code))
+            self.send(404, "<html><body>Not found</body></html>")
+
+        def login(self, form: dict[str, str]):
+            if "UID" not in form:
+                fields = '<input type="text" name="UID">'
+            elif "PW" not in form:
+                fields = (
+                    f'<input type="hidden" name="UID" value="{html.escape(form["UID"])}">'
+                    '<input type="password" name="PW">'
+                )
+            else:
+                # Any credentials will do
+                session = f"{threading.get_ident()}-{time.monotonic_ns()}"
+                with standin.lock:
+                    standin.sessions.add(session)
+                return self.redirect(
+                    PLANNER_PATH, {"Set-Cookie": f"session={session}; Path=/"}
+                )
+            self.send(200, LOGIN_PAGE.format(fields=fields))
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--folder", default="mods", help="Saved pages to serve")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--max-rate", type=float, default=None)
+    args = parser.parse_args()
+
+    standin = StandIn(args.folder, latency=args.latency, max_rate=args.max_rate)
+    server = standin.serve(args.port)
+    print(f"Serving {args.folder}/ at {login_url(server)}, Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"{standin.requests} requests, {standin.rejected} turned away")
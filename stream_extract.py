@@ -0,0 +1,267 @@
+"""
+Streaming alternatives to the BeautifulSoup lookups in extract.Parser.
+
+They walk the page once with html.parser and keep only the text Parser
+needs, instead of building a full tree first. Text is gathered the way
+get_text(strip=True) does it, so the output matches the soup path exactly.
+"""
+
+from html.parser import HTMLParser
+
+# Tags html.parser never sees closed; BeautifulSoup pops them straight away
+VOID_ELEMENTS = frozenset(
+    {
+        "area", "base", "basefont", "bgsound", "br", "col", "command", "embed",
+        "frame", "hr", "image", "img", "input", "isindex", "keygen", "link",
+        "menuitem", "meta", "nextid", "param", "source", "spacer", "track", "wbr",
+    }
+)  # fmt: skip
+# Tags whose strings get_text leaves out
+RAW_TEXT_ELEMENTS = frozenset({"script", "style", "template"})
+
+
+class TextStreamParser(HTMLParser):
+    """
+    Tracks open tags like BeautifulSoup's html.parser builder does, and hands
+    each run of text between two tags to on_string.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        # (tag, payload) for every open tag
+        self.stack: list[tuple[str, object]] = []
+        self.pending: list[str] = []
+        self.raw_depth = 0
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        self.flush()
+        if tag in VOID_ELEMENTS:
+            return
+        if tag in RAW_TEXT_ELEMENTS:
+            self.raw_depth += 1
+        self.stack.append((tag, self.on_start(tag, dict(attrs))))
+
+    def handle_endtag(self, tag: str):
+        self.flush()
+        for depth in range(len(self.stack) - 1, -1, -1):
+            if self.stack[depth][0] == tag:
+                for open_tag, _ in self.stack[depth:]:
+                    if open_tag in RAW_TEXT_ELEMENTS:
+                        self.raw_depth -= 1
+                del self.stack[depth:]
+                return
+
+    def handle_data(self, data: str):
+        self.pending.append(data)
+
+    def handle_comment(self, data: str):
+        self.flush()
+        self.on_string(data, gettext=False)
+
+    def handle_decl(self, decl: str):
+        self.flush()
+
+    def handle_pi(self, data: str):
+        self.flush()
+
+    def flush(self):
+        if self.pending:
+            string = "".join(self.pending)
+            self.pending = []
+            self.on_string(string, gettext=not self.raw_depth)
+
+    def close(self):
+        super().close()
+        self.flush()
+
+    def open_payloads(self, tag: str) -> list:
+        return [payload for open_tag, payload in self.stack if open_tag == tag]
+
+    def on_start(self, tag: str, attrs: dict[str, str | None]) -> object:
+        """Returns the payload kept alongside the open tag."""
+        return None
+
+    def on_string(self, string: str, gettext: bool):
+        """gettext is False for strings get_text would skip, like comments."""
+
+
+class CourseTableParser(TextStreamParser):
+    """
+    Finds the row holding the first "[+]" string and the rows of the table
+    right after that row's table, with their cell texts.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tables = 0
+        self.meta_row: list[list[str]] | None = None
+        self.schedule_table: int | None = None
+        self.rows: list[list[list[str]]] = []
+
+    def on_start(self, tag: str, attrs: dict[str, str | None]) -> object:
+        if tag == "table":
+            self.tables += 1
+            return self.tables
+        if tag == "tr":
+            if self.schedule_table is None:
+                # The metadata row can be any row until "[+]" turns up
+                return []
+            if self.schedule_table in self.open_payloads("table"):
+                self.rows.append([])
+                return self.rows[-1]
+            return None
+        if tag == "td":
+            cell: list[str] = []
+            for row in self.open_payloads("tr"):
+                if row is not None:
+                    row.append(cell)
+            return cell
+        return None
+
+    def on_string(self, string: str, gettext: bool):
+        if self.meta_row is None and "[+]" in string:
+            self.find_meta_row()
+        stripped = string.strip()
+        if gettext and stripped:
+            for cell in self.open_payloads("td"):
+                cell.append(stripped)
+
+    def find_meta_row(self):
+        table, meta_table = None, None
+        for tag, payload in self.stack:
+            if tag == "table":
+                table = payload
+            elif tag == "tr":
+                self.meta_row, meta_table = payload, table  # type: ignore
+        if self.meta_row is None or meta_table is None:
+            return
+        self.schedule_table = meta_table + 1  # type: ignore
+
+    def cell_texts(self) -> tuple[list[str], list[list[str]]]:
+        if self.meta_row is None:
+            raise ValueError("Could not find metadata anchor [+]")
+        return (
+            ["".join(cell) for cell in self.meta_row],
+            [["".join(cell) for cell in row] for row in self.rows],
+        )
+
+
+class VacancyRowParser(TextStreamParser):
+    """
+    For every row, in document order, the text of its first size -1 font and
+    the option texts of its first index_nmbr select.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # [font text parts, select options] per row
+        self.rows: list[list] = []
+
+    def on_start(self, tag: str, attrs: dict[str, str | None]) -> object:
+        if tag == "tr":
+            self.rows.append([None, None])
+            return self.rows[-1]
+        if tag == "font" and attrs.get("size") == "-1":
+            font: list[str] = []
+            for row in self.open_payloads("tr"):
+                if row[0] is None:
+                    row[0] = font
+            return font
+        if tag == "select" and attrs.get("name") == "index_nmbr":
+            options: list[list[str]] = []
+            for row in self.open_payloads("tr"):
+                if row[1] is None:
+                    row[1] = options
+            return options
+        if tag == "option":
+            option: list[str] = []
+            for options in self.open_payloads("select"):
+                if options is not None:
+                    options.append(option)
+            return option
+        return None
+
+    def on_string(self, string: str, gettext: bool):
+        stripped = string.strip()
+        if not gettext or not stripped:
+            return
+        for tag, payload in self.stack:
+            if payload is not None and tag in ("font", "option"):
+                payload.append(stripped)
+
+    def row_texts(self) -> list[tuple[str, list[str]]]:
+        return [
+            ("".join(font), ["".join(option) for option in options])
+            for font, options in self.rows
+            if font is not None and options is not None
+        ]
+
+
+def course_cell_texts(html: str) -> tuple[list[str], list[list[str]]]:
+    """Streaming version of Parser.soup_course_cell_texts."""
+    parser = CourseTableParser()
+    parser.feed(html)
+    parser.close()
+    return parser.cell_texts()
+
+
+def vacancy_row_texts(html: str) -> list[tuple[str, list[str]]]:
+    """Streaming version of Parser.soup_vacancy_row_texts."""
+    parser = VacancyRowParser()
+    parser.feed(html)
+    parser.close()
+    return parser.row_texts()
+
+
+if __name__ == "__main__":
+    # Parity and timing of the two extractors over every page in mods/
+    import os
+    import sys
+    import time
+
+    from extract import Parser
+
+    parser = Parser("mods")
+    mismatches = []
+    for file_name in sorted(os.listdir(parser.folder_path)):
+        if not file_name.endswith(".html"):
+            continue
+        html = parser.read(file_name)
+        if file_name == "stars.html":
+            soup_extract, stream_extract = (
+                Parser.soup_vacancy_row_texts,
+                vacancy_row_texts,
+            )
+        else:
+            soup_extract, stream_extract = (
+                Parser.soup_course_cell_texts,
+                course_cell_texts,
+            )
+        timings = []
+        for extract in (soup_extract, stream_extract):
+            start = time.perf_counter()
+            result = extract(html)
+            timings.append((time.perf_counter() - start, result))
+        (soup_time, soup_result), (stream_time, stream_result) = timings
+        status = "OK" if soup_result == stream_result else "MISMATCH"
+        if soup_result != stream_result:
+            mismatches.append(file_name)
+        print(
+            f"{file_name:12} {status:8} soup {soup_time * 1000:7.1f}ms "
+            f"stream {stream_time * 1000:7.1f}ms ({soup_time / stream_time:.1f}x)"
+        )
+
+    soup_parser = Parser("mods")
+    stream_parser = Parser("mods", extractor="stream")
+    soup_parser.process_all_courses()
+    stream_parser.process_all_courses()
+    same = (
+        soup_parser.courses == stream_parser.courses
+        and soup_parser.vacancies == stream_parser.vacancies
+    )
+    print("Parser output identical:", same)
+    if not same:
+        mismatches.append("Parser output")
+    if mismatches:
+        print(f"Mismatched: {', '.join(mismatches)}")
+        sys.exit(1)